@@ -2,7 +2,8 @@
 
 import logging
 
-from p5d import categorizer, option, retriever, synchronizer, viewer, utils
+from p5d import categorizer, option, retriever, synchronizer, viewer, utils, watcher
+from p5d.catalog import ArtworkCatalog
 from p5d.custom_logger import setup_logging
 from p5d.app_settings import TEMP_DIR
 
@@ -16,29 +17,81 @@ def main():
     config_loader = utils.ConfigLoader(logger)
     config_loader.load_config()
     config_loader.update_config(args.options)
-    combined_paths = config_loader.get_combined_paths()
+    catalog = ArtworkCatalog(config_loader)
+    stats_dir = config_loader.get_stats_dir()
 
-    if not args.no_categorize:
+    if args.rebuild_catalog:
+        logger.info("開始重建作品目錄...")
+        for root in ("local_path", "remote_path"):
+            logger.debug(f"Catalog of '{root}' rebuilt with {catalog.rebuild(root)} files")
+
+    if args.watch:
+        run_watch(config_loader, logger, args, catalog)
+        catalog.close()
+        utils.LogMerger(config_loader.base_dir / TEMP_DIR, logger).merge_logs()
+        return
+
+    categorized = 0
+    if args.apply_plan:
+        logger.info("開始執行分類計畫...")
+        categorized = categorizer.apply_plan(config_loader, logger, catalog=catalog)
+    elif not args.no_categorize:
         logger.info("開始分類檔案...")
-        categorizer.categorize_files(config_loader, args.direct_sync, logger)
+        categorized = categorizer.categorize_files(
+            config_loader, args.direct_sync, logger, args.full_rescan, args.plan, catalog
+        )
 
     if not args.no_sync:
         logger.info("開始同步檔案...")
-        syncer = synchronizer.FileSyncer(config_loader, logger, args.direct_sync, args.options)
+        syncer = synchronizer.FileSyncer(
+            config_loader, logger, args.direct_sync, args.options, catalog
+        )
         syncer.sync_folders(None, None)
 
     if not args.no_retrieve:
         logger.info("開始尋找遺失作品...")
-        retriever.retrieve_artwork(logger, args.download)
+        retriever.retrieve_artwork(logger, args.download, catalog, args.retrieve_api)
+
+    # Remote stats come from the catalog, the local folder is often emptied outside of P5D
+    stats_catalog = catalog if stats_dir == "remote_path" else None
+    if stats_catalog is not None and not catalog.is_built(stats_dir):
+        if not (args.no_view and args.no_categorize):
+            # The first run walks the library once, later runs read from the catalog
+            catalog.rebuild(stats_dir)
 
     if not args.no_view:
         logger.info("開始統計標籤...")
-        viewer.viewer_main(config_loader, logger, config_loader.get_stats_dir())
+        viewer.viewer_main(config_loader, logger, stats_dir, catalog=stats_catalog)
 
     if not args.no_categorize:
-        stats_dir = config_loader.get_stats_dir()
-        file_count = utils.count_files(combined_paths, logger, stats_dir)
+        if stats_catalog is not None:
+            file_count = stats_catalog.count_files(stats_dir)
+        else:
+            # New local files are what the categorizer just handled, no need to walk again
+            file_count = categorized
         happy_msg = "這次新增了" if stats_dir == "local_path" else "遠端資料夾總共有"
         print(f"\033[32m{happy_msg}\033[0m\033[32;1;4m {file_count} \033[0m\033[32m個檔案🍺\033[0m")
 
+    catalog.close()
     utils.LogMerger(config_loader.base_dir / TEMP_DIR, logger).merge_logs()
+
+
+def run_watch(
+    config_loader: utils.ConfigLoader, logger: logging.Logger, args, catalog: ArtworkCatalog
+) -> None:
+    syncer = None
+    if not args.no_sync:
+        syncer = synchronizer.FileSyncer(
+            config_loader, logger, args.direct_sync, args.options, catalog
+        )
+
+    def run_batch():
+        # Folders may have been remounted or replaced since the last batch
+        utils.get_device.cache_clear()
+        utils.CROSS_DEVICE_PAIRS.clear()
+        categorizer.categorize_files(config_loader, args.direct_sync, logger, catalog=catalog)
+        if syncer is not None:
+            syncer.sync_folders(None, None)
+
+    local_path = config_loader.get_base_paths()["local_path"]
+    watcher.watch(local_path, run_batch, logger)
@@ -32,6 +32,9 @@ elif is_docker():
 else:
     FONT = "Arial Unicode MS"
 
+# Default filesystems of Windows and macOS ignore the case of file names
+CASE_INSENSITIVE_FS = USER_OS in ("Windows", "Darwin")
+
 
 # Output directory of all files.
 OUTPUT_DIR = "data"
@@ -43,18 +46,92 @@ RETRIEVE_DIR = os.path.join(OUTPUT_DIR, "retrieve")
 # Source site for retrieve missing artwork
 DANBOORU_URL = "https://danbooru.donmai.us/"
 DANBOORU_SEARCH_URL = "https://danbooru.donmai.us/posts?tags=pixiv%3A{}&z=5"
+# Posts JSON API of --retrieve-api, the fields it returns and the most posts per page
+DANBOORU_API_URL = "https://danbooru.donmai.us/posts.json"
+DANBOORU_API_FIELDS = "id,pixiv_id,is_banned"
+DANBOORU_API_LIMIT = 200
 MISS_LOG = "id"
+# Number of concurrent lookups and seconds before a request times out
+RETRIEVE_WORKERS = 5
+RETRIEVE_TIMEOUT = 30
+# Pixiv ids per request of --retrieve-api
+RETRIEVE_BATCH = 20
+# Pixiv ids read from the missing list and checked against the catalog and cache at once
+RETRIEVE_CHUNK = 1000
+# Lookup results stored in TEMP_DIR, found posts are kept for RETRIEVE_POSITIVE_TTL seconds and
+# ids without posts for RETRIEVE_NEGATIVE_TTL
+RETRIEVE_CACHE = "retrieve_cache.json"
+RETRIEVE_POSITIVE_TTL = 30 * 24 * 3600
+RETRIEVE_NEGATIVE_TTL = 3 * 24 * 3600
+# Requests per second of the retriever, it starts at RETRIEVE_RATE, halves on HTTP 429 and
+# grows by RETRIEVE_RATE_STEP per success
+RETRIEVE_RATE = 4.0
+RETRIEVE_MAX_RATE = 10.0
+RETRIEVE_MIN_RATE = 0.2
+RETRIEVE_RATE_STEP = 0.1
+# Random extra wait on HTTP 429, as a fraction of the wait
+RETRIEVE_JITTER = 0.2
+
+# watcher.py
+# Seconds without changes before a batch starts, longest wait and polling interval
+WATCH_SETTLE = 5.0
+WATCH_MAX_DELAY = 60.0
+WATCH_INTERVAL = 2.0
+# Extensions of unfinished browser downloads, never categorized
+PARTIAL_EXT = (".crdownload", ".part", ".download", ".tmp")
+
+# catalog.py
+# SQLite catalog of the library, stored in OUTPUT_DIR
+CATALOG_DB = "catalog.sqlite3"
+
+# deduper.py
+# Hashes of duplicate detection, stored in TEMP_DIR
+HASH_CACHE = "hash_cache.json"
+# Bytes hashed before files of the same size are fully hashed
+HASH_PARTIAL_BYTES = 64 * 1024
+# Number of concurrent full hashes
+HASH_WORKERS = 4
+# Values of the dedup custom setting
+DEDUP_MODES = ("skip", "link")
 
 # viewer.py
 # Output file name.
 STATS_FILE = "tag_stats"
 
+# synchronizer.py
+# Hard link tree of a direct_sync run, created in local_path and removed after the transfer
+STAGE_DIR = ".p5d_stage"
+# Number of concurrent rsync jobs, overall and per destination device
+SYNC_JOBS = 4
+SYNC_JOBS_PER_DEVICE = 2
+# Folders with at least this many subfolders are synced as one job per subfolder, 0 disables it
+SYNC_SPLIT_DIRS = 8
+# Values of the sync_strategy custom setting, "link" and "reflink" are native with links
+SYNC_STRATEGIES = ("rsync", "native", "link", "reflink")
+# Number of concurrent copies of the native sync strategy
+SYNC_COPY_WORKERS = 8
+# Cached listings of remote folders, stored in TEMP_DIR
+REMOTE_MANIFEST = "remote_manifest.json"
+
 # logger.py
 # Extension of temp rsync log
 RSYNC_TEMP_EXT = ".logfile"
+# Format of rsync log lines, itemized changes followed by the file size
+RSYNC_LOG_FORMAT = "%i %l %n%L"
+# Transfer statistics per category and run, stored in OUTPUT_DIR
+SYNC_STATS = "sync_stats.jsonl"
 
 # categorizer.py
 # Folder name of OtherCategorizer
 EN = "EN Artist"
 JP = "JP Artist"
 OTHER = "Other Artist"
+# Number of concurrent file moves
+MOVE_WORKERS = 8
+# Move plan written by --plan, stored in OUTPUT_DIR
+MOVE_PLAN = "move_plan.jsonl"
+# Per-directory watermarks of incremental categorization, stored in TEMP_DIR
+SCAN_STATE = "scan_state.json"
+# direct_sync file lists grouped by destination and their index, stored in TEMP_DIR
+MAPPING_FILE = "mapping.txt"
+MAPPING_INDEX = "mapping_index.json"
@@ -0,0 +1,238 @@
+import os
+import re
+import sqlite3
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from p5d.app_settings import CATALOG_DB, OUTPUT_DIR
+from p5d.mover import MoveTask
+from p5d.utils import ConfigLoader, is_partial, is_system, scan_dir, split_tags, walk_tree
+
+# Pixiv Downloader names artworks `{id}_p{page}`
+PIXIV_ID_PATTERN = re.compile(r"(?<!\d)(\d+)_p(\d+)")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    root TEXT NOT NULL,
+    category TEXT NOT NULL,
+    pixiv_id TEXT,
+    page INTEGER,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS file_tags (
+    path TEXT NOT NULL,
+    tag TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS roots (
+    root TEXT PRIMARY KEY
+);
+CREATE INDEX IF NOT EXISTS idx_files_root ON files (root, category);
+CREATE INDEX IF NOT EXISTS idx_files_pixiv_id ON files (pixiv_id);
+CREATE INDEX IF NOT EXISTS idx_file_tags_path ON file_tags (path);
+"""
+
+
+class CatalogRecord(NamedTuple):
+    """
+    One file of the library.
+
+    Attributes:
+        path: Absolute file path.
+        root: The base path the file lives under, "local_path" or "remote_path".
+        category: Category folder of the file, empty if it is not in any category.
+        pixiv_id: Pixiv artwork id parsed from the file name, None if there is none.
+        page: Page number of the artwork, None if there is none.
+        tags: Tags split from the file name, the last one keeps the extension.
+        size: File size in bytes.
+        mtime_ns: Modification time in nanoseconds.
+    """
+
+    path: str
+    root: str
+    category: str
+    pixiv_id: Optional[str]
+    page: Optional[int]
+    tags: list[str]
+    size: int
+    mtime_ns: int
+
+
+class ArtworkCatalog:
+    """
+    Indexed catalog of the library in SQLite, one record per file.
+
+    The categorizer records files as they are moved and the synchronizer as they are sent, so
+    file counts, tag stats and pixiv id lookups are answered from the index instead of walking
+    the remote tree. A root is walked once with `rebuild` before it is trusted, run
+    `--rebuild-catalog` after files are changed outside of P5D.
+
+    Args:
+        config_loader (ConfigLoader): Provides the base paths, categories and tag delimiters.
+        db_path (str | Path, optional): Database file, defaults to OUTPUT_DIR/CATALOG_DB.
+    """
+
+    def __init__(self, config_loader: ConfigLoader, db_path: Optional[str | Path] = None):
+        self.db_path = Path(db_path or Path(config_loader.base_dir) / OUTPUT_DIR / CATALOG_DB)
+        self.tag_delimiter = config_loader.get_delimiters()
+        self.base_paths = config_loader.get_base_paths()
+        combined_paths = config_loader.get_combined_paths()
+        # Deepest folder first so nested categories win over their parents
+        self.category_paths = {
+            root: sorted(
+                ((Path(paths[root]), category) for category, paths in combined_paths.items()),
+                key=lambda item: len(item[0].parts),
+                reverse=True,
+            )
+            for root in ("local_path", "remote_path")
+        }
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The database connection, opened on first use so runs that never need it skip it."""
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self) -> "ArtworkCatalog":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def make_record(
+        self, path: str | Path, root: str, stat: os.stat_result, category: Optional[str] = None
+    ) -> CatalogRecord:
+        path = Path(path)
+        if category is None:
+            category = self.category_of(path, root)
+        match = PIXIV_ID_PATTERN.search(path.stem)
+        pixiv_id, page = (match.group(1), int(match.group(2))) if match else (None, None)
+        # The whole name like viewer.count_tags, so tag statistics do not depend on the source
+        tags = split_tags(path.name, self.tag_delimiter)
+        return CatalogRecord(
+            str(path), root, category, pixiv_id, page, tags, stat.st_size, stat.st_mtime_ns
+        )
+
+    def category_of(self, path: Path, root: str) -> str:
+        for category_path, category in self.category_paths[root]:
+            if path.is_relative_to(category_path):
+                return category
+        return ""
+
+    def add(self, records: Iterable[CatalogRecord]) -> int:
+        """Insert or replace records and return the number written."""
+        records = list(records)
+        if not records:
+            return 0
+        with self.conn:
+            self._delete_tags(record.path for record in records)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (r.path, r.root, r.category, r.pixiv_id, r.page, r.size, r.mtime_ns)
+                    for r in records
+                ],
+            )
+            self.conn.executemany(
+                "INSERT INTO file_tags VALUES (?, ?)",
+                [(record.path, tag) for record in records for tag in record.tags],
+            )
+        return len(records)
+
+    def remove(self, paths: Iterable[str | Path]) -> None:
+        paths = [str(path) for path in paths]
+        with self.conn:
+            self._delete_tags(paths)
+            self.conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in paths])
+
+    def record_moves(self, tasks: Iterable[MoveTask], root: str = "local_path") -> int:
+        """Record the destinations of moved files in place of their sources."""
+        tasks = list(tasks)
+        records = []
+        for task in tasks:
+            try:
+                stat = os.stat(task.dst)
+            except OSError:
+                continue
+            records.append(self.make_record(task.dst, root, stat, task.category or None))
+        self.remove(task.src for task in tasks)
+        return self.add(records)
+
+    def record_copies(
+        self, copies: Iterable[tuple[Path, os.stat_result]], root: str = "remote_path"
+    ) -> int:
+        """Record files sent by the synchronizer, with the stat of the source or the copy."""
+        return self.add(self.make_record(path, root, stat) for path, stat in copies)
+
+    def rebuild(self, root: str) -> int:
+        """Walk the base path of root and replace all its records, return the file count."""
+        records = (
+            self.make_record(entry.path, root, stat)
+            for entry, stat in walk_tree([self.base_paths[root]], with_stat=True)
+            if not is_partial(entry.name)
+        )
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM file_tags WHERE path IN (SELECT path FROM files WHERE root = ?)",
+                (root,),
+            )
+            self.conn.execute("DELETE FROM files WHERE root = ?", (root,))
+        count = self.add(records)
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO roots VALUES (?)", (root,))
+        return count
+
+    def is_built(self, root: str) -> bool:
+        row = self.conn.execute("SELECT 1 FROM roots WHERE root = ?", (root,)).fetchone()
+        return row is not None
+
+    def count_files(self, root: str) -> int:
+        """Number of files in category folders, system files are never recorded."""
+        row = self.conn.execute(
+            "SELECT COUNT(*) FROM files WHERE root = ? AND category != ''", (root,)
+        ).fetchone()
+        return row[0]
+
+    def tag_counts(self, root: str) -> tuple[Counter, int]:
+        """Tag counts and number of files of everything under the base path of root."""
+        rows = self.conn.execute(
+            "SELECT tag, COUNT(*) FROM file_tags JOIN files USING (path) "
+            "WHERE files.root = ? GROUP BY tag",
+            (root,),
+        )
+        tag_counts = Counter(dict(rows.fetchall()))
+        total = self.conn.execute("SELECT COUNT(*) FROM files WHERE root = ?", (root,)).fetchone()
+        return tag_counts, total[0]
+
+    def has_pixiv_id(self, pixiv_id: str, root: Optional[str] = None) -> bool:
+        query, params = "SELECT 1 FROM files WHERE pixiv_id = ?", [pixiv_id]
+        if root is not None:
+            query, params = query + " AND root = ?", params + [root]
+        return self.conn.execute(query + " LIMIT 1", params).fetchone() is not None
+
+    def _delete_tags(self, paths: Iterable[str]) -> None:
+        self.conn.executemany("DELETE FROM file_tags WHERE path = ?", [(path,) for path in paths])
+
+
+def walk_files(directory: str | Path) -> Iterator[os.DirEntry]:
+    """Yield the DirEntry of every file below directory, skipping system and partial files."""
+    pending = [directory]
+    while pending:
+        for entry in scan_dir(pending.pop()):
+            if entry.is_dir(follow_symlinks=False):
+                pending.append(entry.path)
+            elif entry.is_file() and not is_system(entry.name) and not is_partial(entry.name):
+                yield entry
@@ -3,24 +3,37 @@
 
 # Todo: glob file type to conf.py
 # Todo: IPTC/EXIF writer
+import json
 import logging
 import os
 from abc import ABC, abstractmethod
-from collections import deque
 from logging import Logger
 from pathlib import Path
 from typing import Optional, Type, Iterator
 
 from p5d import custom_logger
-from p5d.app_settings import EN, JP, OTHER, TEMP_DIR
+from p5d.app_settings import (
+    EN,
+    JP,
+    MAPPING_FILE,
+    MAPPING_INDEX,
+    MOVE_PLAN,
+    OTHER,
+    OUTPUT_DIR,
+    SCAN_STATE,
+    TEMP_DIR,
+)
+from p5d.catalog import ArtworkCatalog
+from p5d.deduper import Deduplicator
+from p5d.mover import MoveExecutor, MoveTask, read_plan, write_plan
 from p5d.utils import (
     ConfigLoader,
-    traverse_dir,
-    get_tagged_path,
+    DirectorySnapshot,
+    ScanWatermark,
+    get_resolver_name,
+    is_system,
+    TagMatcher,
     safe_rmtree,
-    split_tags,
-    safe_move,
-    normalize_path,
     is_english,
     is_japanese,
     is_empty,
@@ -29,14 +42,22 @@ from p5d.utils import (
 
 # Do NOT change unless necessary
 class PathResolver:
-    def __init__(self, config_loader: ConfigLoader, direct_sync: bool, logger: Logger):
+    def __init__(
+        self,
+        config_loader: ConfigLoader,
+        direct_sync: bool,
+        logger: Logger,
+        snapshot: Optional[DirectorySnapshot] = None,
+    ):
         self.config_loader = config_loader
-        self.categories = config_loader.get_categories()
-        self.combined_paths = config_loader.get_combined_paths()
+        self.routes = config_loader.get_routing_table()
         self.tag_delimiter = config_loader.get_delimiters()
         self.direct_sync = direct_sync
-        self.dst_base_type = "remote_path" if self.direct_sync else "local_path"
         self.logger = logger
+        self.matchers: dict[str, TagMatcher] = {}
+        self.matched_tags: dict[Path, str] = {}
+        self.drained_paths: list[Path] = []
+        self.snapshot = snapshot or DirectorySnapshot()
 
     @abstractmethod
     def get_destination(self, category: str, file_path: Path) -> Path:
@@ -61,15 +82,40 @@ class PathResolver:
         """
         pass
 
+    def cleanup(self) -> None:
+        """Called once the files yielded by category_iter have been moved."""
+        while self.drained_paths:
+            safe_rmtree(self.drained_paths.pop())
+
+    def log_unmatched(self, top_n: int = 5) -> None:
+        for category, matcher in self.matchers.items():
+            if matcher.unmatched:
+                common = ", ".join(
+                    f"{tag} ({n})" for tag, n in matcher.unmatched.most_common(top_n)
+                )
+                self.logger.info(f"Unmatched tags of '{category}': {common}")
+
     def get_config(self, category: str) -> tuple[Path, dict[str, str]]:
-        base_path = Path(self.combined_paths[category]["local_path"])
-        user_tags = self.categories[category].get("tags", "")
-        return base_path, user_tags
+        route = self.routes[category]
+        return route.local_path, route.tags
+
+    def get_dst_base(self, category: str) -> Path:
+        route = self.routes[category]
+        return route.remote_path if self.direct_sync else route.local_path
+
+    def get_tagged_destination(self, category: str, file_path: Path) -> Path:
+        if category not in self.matchers:
+            self.matchers[category] = TagMatcher(self.routes[category].tags, self.tag_delimiter)
+        base_path = self.get_dst_base(category)
+        folder, tag = self.matchers[category].match(file_path.name)
+        if tag:
+            self.matched_tags[file_path] = tag
+        return base_path / folder / file_path.name
 
 
 class FilenamePathResolver(PathResolver):
     def get_destination(self, category: str, file_path: Path) -> Path:
-        base_path = Path(self.combined_paths[category][self.dst_base_type])
+        base_path = self.get_dst_base(category)
         first_char = file_path.name[0]
         if is_english(first_char):
             folder_name = EN
@@ -81,118 +127,225 @@ class FilenamePathResolver(PathResolver):
 
     def category_iter(self, category: str) -> Iterator[tuple[Path, Path]]:
         base_path, _ = self.get_config(category)
-        for file_src in traverse_dir(base_path.parent):
+        for file_src in self.snapshot.files(base_path.parent):
             file_dst = self.get_destination(category, file_src)
             yield file_src, file_dst
 
 
 class CategoryPathResolver(PathResolver):
     def get_destination(self, category: str, file_path: Path) -> Path:
-        user_tags = self.categories[category].get("tags", "")
-        base_path = Path(self.combined_paths[category][self.dst_base_type])
-        file_tags = split_tags(str(file_path), self.tag_delimiter)
-        return get_tagged_path(base_path, file_tags, user_tags) / file_path.name
+        return self.get_tagged_destination(category, file_path)
 
     def category_iter(self, category: str) -> Iterator[tuple[Path, Path]]:
         base_path, _ = self.get_config(category)
         if category == "Others":
             base_path = base_path.parent
-        for file_src in traverse_dir(base_path):
+        for file_src in self.snapshot.files(base_path):
             file_dst = self.get_destination(category, file_src)
             yield file_src, file_dst
 
 
 class ChildPathResolver(PathResolver):
     def get_destinations(self, category: str, file_path: Path) -> Path:
-        user_tags = self.categories[category].get("tags", "")
-        base_path = Path(self.combined_paths[category][self.dst_base_type])
-        file_tags = split_tags(str(file_path), self.tag_delimiter)
-        return get_tagged_path(base_path, file_tags, user_tags) / file_path.name
+        return self.get_tagged_destination(category, file_path)
 
     def category_iter(self, category: str) -> Iterator[tuple[Path, Path]]:
-        base_path, _ = self.get_config(category)
-        child_paths = [base_path.parent / child for child in self.categories[category]["children"]]
-        for child_path in child_paths:
-            for file_src in traverse_dir(child_path):
+        for child_path in self.routes[category].children:
+            if not self.snapshot.is_dir(child_path):
+                continue
+            yielded = set()
+            for file_src in self.snapshot.files(child_path):
+                yielded.add(file_src.name)
                 destinations = self.get_destinations(category, file_src)
                 yield file_src, destinations
-            safe_rmtree(child_path)
+            if self.is_drained(child_path, yielded):
+                self.drained_paths.append(child_path)
+
+    def is_drained(self, child_path: Path, yielded: set[str]) -> bool:
+        """
+        Decide from the listing the resolver observed whether only system files are left once the
+        yielded files are moved. `safe_rmtree` checks the folder again before removing it.
+        """
+        listing = self.snapshot.listings.get(child_path)
+        if listing is None:
+            # Skipped by the watermark, nothing was moved out of it
+            return False
+        return all(
+            not entry.is_dir(follow_symlinks=False) and is_system(name)
+            for name, entry in listing.items()
+            if name not in yielded
+        )
 
 
 class SimplePathResolver(PathResolver):
     def get_destinations(self, category: str, file_path: Path) -> Path:
-        base_path = Path(self.combined_paths[category][self.dst_base_type])
         if self.direct_sync:
-            file_dst = base_path / file_path.name
+            file_dst = self.get_dst_base(category) / file_path.name
         else:
             file_dst = file_path
 
         return file_dst
 
     def category_iter(self, category: str) -> Iterator[tuple[Path, Path]]:
-        base_path = Path(self.combined_paths[category]["local_path"])
-        for file_src in traverse_dir(base_path):
+        base_path, _ = self.get_config(category)
+        for file_src in self.snapshot.files(base_path):
             yield file_src, self.get_destinations(category, file_src)
 
 
 class ResolverAdapter:
-    def __init__(self, config_loader: ConfigLoader, direct_sync: bool, logger: Logger):
+    def __init__(
+        self,
+        config_loader: ConfigLoader,
+        direct_sync: bool,
+        logger: Logger,
+        snapshot: Optional[DirectorySnapshot] = None,
+    ):
         self.config_loader = config_loader
         self.direct_sync = direct_sync
         self.logger = logger
+        # Shared by every resolver so each directory is listed only once per pass
+        self.snapshot = snapshot or DirectorySnapshot()
         self.resolver_classes: dict[str, Type[PathResolver]] = {
             "category": CategoryPathResolver,
             "child": ChildPathResolver,
             "filename": FilenamePathResolver,
             "simple": SimplePathResolver,
         }
-        self.resolver_queue = deque(maxlen=2)
         self.resolver_cache: dict[str, PathResolver] = {}
 
-    def get_resolver(self, category: str, categories: dict[str, dict[str, str]]) -> PathResolver:
-        if "children" in categories[category]:
-            resolver_name = "child"
-        elif "tags" in categories[category]:
-            resolver_name = "category"
-        elif category == "Others":
-            resolver_name = "filename"
-        else:
-            resolver_name = "simple"
+    def get_resolver_name(self, category: str, categories: dict[str, dict[str, str]]) -> str:
+        return get_resolver_name(category, categories[category])
 
+    def get_resolver(self, category: str, categories: dict[str, dict[str, str]]) -> PathResolver:
+        resolver_name = self.get_resolver_name(category, categories)
         self.logger.debug(f"Processing '{category}' with path resolver '{resolver_name}'")
 
         if resolver_name in self.resolver_cache:
             return self.resolver_cache[resolver_name]
 
         new_resolver = self.resolver_classes[resolver_name](
-            self.config_loader, self.direct_sync, self.logger
+            self.config_loader, self.direct_sync, self.logger, self.snapshot
         )
-
-        if len(self.resolver_queue) == self.resolver_queue.maxlen:
-            oldest_resolver_name = self.resolver_queue.popleft()
-            del self.resolver_cache[oldest_resolver_name]
-
-        self.resolver_queue.append(resolver_name)
         self.resolver_cache[resolver_name] = new_resolver
         return new_resolver
 
 
-def categorize_files(config_loader: ConfigLoader, direct_sync: bool, logger: Logger):
+def categorize_files(
+    config_loader: ConfigLoader,
+    direct_sync: bool,
+    logger: Logger,
+    full_rescan: bool = False,
+    plan_only: bool = False,
+    catalog: Optional[ArtworkCatalog] = None,
+) -> int:
+    """
+    Categorize files of all categories and return the number of files categorized in this run.
+
+    Folders that have not changed since the last run are skipped based on the watermarks stored
+    in TEMP_DIR. Set `full_rescan` to scan every folder again. Watermarks are not used in
+    direct_sync mode, files stay in their folders until the sync sends them, and a folder is not
+    recorded while files of it failed to move, so they are retried in the next run.
+
+    With `plan_only` the move plan is written to OUTPUT_DIR/MOVE_PLAN instead of being executed,
+    use `apply_plan` to run it later. The direct_sync mapping is a plan already and is written
+    as usual.
+
+    Files with identical content are found before anything is moved, see `Deduplicator` for the
+    `dedup` setting. Moved files are recorded in the catalog if one is given.
+    """
     categories = config_loader.get_categories()
-    adapter = ResolverAdapter(config_loader, direct_sync, logger)
+    temp_dir_abs = Path(config_loader.base_dir) / TEMP_DIR
+    watermark = None if direct_sync else ScanWatermark(temp_dir_abs / SCAN_STATE, full_rescan)
+    adapter = ResolverAdapter(config_loader, direct_sync, logger, DirectorySnapshot(watermark))
     mapping_file = {}
+    move_tasks: list[MoveTask] = []
+    used_resolvers: list[PathResolver] = []
     for category in categories:
         path_resolver = adapter.get_resolver(category, categories)
+        resolver_name = adapter.get_resolver_name(category, categories)
+        if path_resolver not in used_resolvers:
+            used_resolvers.append(path_resolver)
         for file_src, file_dst in path_resolver.category_iter(category):
-            if direct_sync:
-                mapping_file = add_to_sync(mapping_file, str(file_src), str(file_dst.parent))
-            else:
-                safe_move(file_src, file_dst, logger)
+            tag = path_resolver.matched_tags.get(file_src, "")
+            move_tasks.append(MoveTask(file_src, file_dst, resolver_name, tag, category=category))
+
+    deduper = Deduplicator(config_loader, logger)
+    move_tasks, duplicates = deduper.filter_tasks(move_tasks)
+    if direct_sync:
+        # Duplicates cannot be linked on the remote, leave them out of the transfer
+        for task in move_tasks:
+            if task.src not in duplicates:
+                mapping_file = add_to_sync(mapping_file, str(task.src), str(task.dst.parent))
+
+    fsync = bool(config_loader.get_custom().get("fsync", False))
+    executor = MoveExecutor(logger, adapter.snapshot, fsync=fsync)
+    if plan_only and not direct_sync:
+        plan = executor.plan(move_tasks)
+        cleanup = [path for resolver in used_resolvers for path in resolver.drained_paths]
+        plan_path = Path(config_loader.base_dir) / OUTPUT_DIR / MOVE_PLAN
+        count = write_plan(plan, cleanup, plan_path)
+        logger.info(f"Move plan of {count} files written to '{plan_path}'")
+        for path_resolver in used_resolvers:
+            path_resolver.log_unmatched()
+        return count
+
+    # Files already in their category folder count as categorized too
+    categorized = sum(map(len, mapping_file.values())) if direct_sync else len(move_tasks)
+    if not direct_sync:
+        plan = executor.plan(move_tasks)
+        moved = executor.execute(plan)
+        categorized -= len(plan) - moved
+        if moved < len(plan):
+            moved_sources = {task.src for task in executor.moved}
+            for task in plan:
+                if task.src not in moved_sources:
+                    watermark.discard(task.src.parent)
+        linked = deduper.link(executor.moved, duplicates)
+        if linked:
+            logger.info(f"Replaced {linked} duplicate files with hard links")
+        if catalog is not None:
+            in_place = [task for task in move_tasks if task.src == task.dst]
+            catalog.record_moves(in_place + executor.moved)
+    for path_resolver in used_resolvers:
+        path_resolver.cleanup()
+        path_resolver.log_unmatched()
+
+    if watermark is not None:
+        if watermark.skipped:
+            logger.debug(f"Skipped {len(watermark.skipped)} unchanged folders")
+        watermark.save()
 
     if direct_sync:
-        temp_dir_abs = Path(config_loader.base_dir) / TEMP_DIR
         temp_dir_abs.mkdir(exist_ok=True, parents=True)
-        write_mapping(mapping_file, str(temp_dir_abs / "mapping.txt"))
+        write_mapping(mapping_file, temp_dir_abs / MAPPING_FILE)
+    return categorized
+
+
+def apply_plan(
+    config_loader: ConfigLoader,
+    logger: Logger,
+    plan_path: Optional[Path] = None,
+    catalog: Optional[ArtworkCatalog] = None,
+) -> int:
+    """
+    Apply a move plan written by `categorize_files` without running the path resolvers, return
+    the number of files moved.
+    """
+    plan_path = plan_path or Path(config_loader.base_dir) / OUTPUT_DIR / MOVE_PLAN
+    try:
+        plan, cleanup = read_plan(plan_path)
+    except FileNotFoundError:
+        logger.error(f"Move plan '{plan_path}' not found")
+        return 0
+    fsync = bool(config_loader.get_custom().get("fsync", False))
+    executor = MoveExecutor(logger, fsync=fsync)
+    moved = executor.execute(plan, verify=True)
+    if catalog is not None:
+        catalog.record_moves(executor.moved)
+    for path in cleanup:
+        safe_rmtree(path)
+    logger.info(f"Applied move plan '{plan_path}': {moved}/{len(plan)} files moved")
+    return moved
 
 
 def add_to_sync(
@@ -204,13 +357,35 @@ def add_to_sync(
     return sync_map
 
 
-def write_mapping(mapping: dict[str, list[str]], file_path: str) -> None:
-    with open(file_path, "w", encoding="utf-8") as f:
+def write_mapping(mapping: dict[str, list[str]], file_path: str | Path) -> None:
+    """
+    Write the direct_sync mapping in a single pass.
+
+    The file holds the source files grouped by destination, one per line. MAPPING_INDEX next
+    to it stores the destination, byte offset and byte length of each group, the mapping is read
+    once and never rewritten. Paths are stored as is, the synchronizer converts them for rsync.
+    """
+    file_path = Path(file_path)
+    index = []
+    with open(file_path, "wb") as f:
         for file_dst, file_srcs in mapping.items():
-            f.write(f"[key]{file_dst}\n")
-            for file_src in file_srcs:
-                normalized_path = normalize_path(file_src).rstrip("/")
-                f.write(f"[value]{normalized_path}\n")
+            lines = "".join(f"{src}\n" for src in file_srcs)
+            data = lines.encode("utf-8")
+            index.append([file_dst, f.tell(), len(data)])
+            f.write(data)
+    with open(file_path.with_name(MAPPING_INDEX), "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+
+
+def read_mapping(file_path: str | Path) -> Iterator[tuple[str, str]]:
+    """Yield each destination of a mapping written by `write_mapping` with its file list."""
+    file_path = Path(file_path)
+    with open(file_path.with_name(MAPPING_INDEX), "r", encoding="utf-8") as f:
+        index = json.load(f)
+    with open(file_path, "rb") as f:
+        for file_dst, offset, size in index:
+            f.seek(offset)
+            yield file_dst, f.read(size).decode("utf-8")
 
 
 def main():
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional
+
+from p5d.app_settings import DEDUP_MODES, HASH_CACHE, HASH_PARTIAL_BYTES, HASH_WORKERS, TEMP_DIR
+from p5d.mover import MoveTask
+from p5d.utils import COPY_BUFSIZE, ConfigLoader, traverse_dir
+
+
+class HashCache:
+    """
+    File hashes persisted between runs.
+
+    Entries are keyed by path and only valid while size and mtime still match, so a rerun over
+    the same files hashes nothing.
+
+    Args:
+        cache_path (str | Path): JSON file that stores the hashes.
+    """
+
+    def __init__(self, cache_path: str | Path):
+        self.cache_path = Path(cache_path)
+        self.entries: dict[str, list] = self._load()
+        self.dirty = False
+
+    def get(self, path: Path, stat: os.stat_result, kind: str) -> Optional[str]:
+        entry = self.entries.get(str(path))
+        if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+            return None
+        return entry[2].get(kind)
+
+    def put(self, path: Path, stat: os.stat_result, kind: str, digest: str) -> None:
+        entry = self.entries.get(str(path))
+        if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+            entry = [stat.st_size, stat.st_mtime_ns, {}]
+            self.entries[str(path)] = entry
+        entry[2][kind] = digest
+        self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.cache_path, "w", encoding="utf-8") as file:
+            json.dump(self.entries, file, ensure_ascii=False)
+        self.dirty = False
+
+    def _load(self) -> dict[str, list]:
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+
+class Deduplicator:
+    """
+    Find files with identical content before they are moved or synced.
+
+    Files are bucketed by size, then by a hash of the first HASH_PARTIAL_BYTES, and only files
+    that still collide are fully hashed on a thread pool. Of each group of identical files the
+    first path in sort order is kept as the original.
+
+    The mode comes from `dedup` of the [custom] config section:
+        - "skip": duplicates are not moved and not transferred.
+        - "link": duplicates are moved, then replaced by a hard link to the original.
+    Both modes leave duplicates out of rsync transfers, an empty mode disables deduplication.
+
+    Args:
+        config_loader (ConfigLoader): Provides the dedup mode and the temp folder.
+        logger (logging.Logger): A logging instance to use for logging messages.
+        max_workers (int, optional): Number of concurrent full hashes, defaults to HASH_WORKERS.
+    """
+
+    def __init__(
+        self,
+        config_loader: ConfigLoader,
+        logger: logging.Logger,
+        max_workers: int = HASH_WORKERS,
+    ):
+        self.logger = logger
+        self.mode = config_loader.get_custom().get("dedup", "")
+        if self.mode and self.mode not in DEDUP_MODES:
+            logger.error(f"Unknown dedup mode '{self.mode}', expected one of {DEDUP_MODES}")
+            self.mode = ""
+        self.cache = HashCache(Path(config_loader.base_dir) / TEMP_DIR / HASH_CACHE)
+        self.max_workers = max(1, max_workers)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.mode)
+
+    def find(self, paths: Iterable[Path]) -> dict[Path, Path]:
+        """Return a mapping of each duplicate file to the original it duplicates."""
+        by_size: dict[int, list[tuple[Path, os.stat_result]]] = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            # Empty files are all identical, they are not worth linking
+            if stat.st_size:
+                by_size.setdefault(stat.st_size, []).append((Path(path), stat))
+
+        groups = [group for group in by_size.values() if len(group) > 1]
+        for kind in ("partial", "full"):
+            if not groups:
+                break
+            digests = self._hash_all([item for group in groups for item in group], kind)
+            groups = self._split(groups, digests)
+        self.cache.save()
+
+        duplicates = {}
+        for group in groups:
+            original, *copies = sorted(path for path, _ in group)
+            for copy in copies:
+                duplicates[copy] = original
+        return duplicates
+
+    def filter_tasks(self, tasks: list[MoveTask]) -> tuple[list[MoveTask], dict[Path, Path]]:
+        """
+        Drop duplicate moves in skip mode.
+
+        Returns:
+            tasks: The move tasks to run.
+            duplicates: Source of each duplicate to the source of its original.
+        """
+        if not self.enabled:
+            return tasks, {}
+        duplicates = self.find(task.src for task in tasks)
+        for duplicate, original in duplicates.items():
+            self.logger.info(f"'{duplicate}' is a duplicate of '{original}'")
+        if self.mode == "skip":
+            tasks = [task for task in tasks if task.src not in duplicates]
+        return tasks, duplicates
+
+    def link(self, moved_tasks: Iterable[MoveTask], duplicates: dict[Path, Path]) -> int:
+        """
+        Replace moved duplicates with hard links to their moved originals, in link mode.
+
+        Only moves that succeeded may be passed, the destination of a failed move can hold an
+        unrelated file.
+        """
+        if self.mode != "link" or not duplicates:
+            return 0
+        moved = {task.src: task.dst for task in moved_tasks}
+        linked = 0
+        for duplicate, original in duplicates.items():
+            dst, original_dst = moved.get(duplicate), moved.get(original)
+            if dst is None or original_dst is None:
+                continue
+            temp_path = dst.with_name(f".{dst.name}.link")
+            try:
+                os.link(original_dst, temp_path)
+                os.replace(temp_path, dst)
+                linked += 1
+            except OSError as e:
+                self.logger.debug(f"Failed to hard link '{dst}' to '{original_dst}': {e}")
+                temp_path.unlink(missing_ok=True)
+        return linked
+
+    def excludes(self, folders: Iterable[Path]) -> dict[Path, list[str]]:
+        """
+        Find duplicates across the files of `folders`.
+
+        Returns:
+            excludes: Folder to the paths of its duplicates, relative to the folder.
+        """
+        if not self.enabled:
+            return {}
+        folders = [Path(folder) for folder in folders]
+        files = [path for folder in folders for path in traverse_dir(folder, recursive=True)]
+        excludes: dict[Path, list[str]] = {}
+        for duplicate in self.find(files):
+            for folder in folders:
+                if duplicate.is_relative_to(folder):
+                    excludes.setdefault(folder, []).append(duplicate.relative_to(folder).as_posix())
+                    break
+        return excludes
+
+    def _hash_all(self, items: list[tuple[Path, os.stat_result]], kind: str) -> dict[Path, str]:
+        digests: dict[Path, str] = {}
+        pending = []
+        for path, stat in items:
+            digest = self.cache.get(path, stat, kind)
+            if digest is None and kind == "full" and stat.st_size <= HASH_PARTIAL_BYTES:
+                # The partial hash covered the whole file
+                digest = self.cache.get(path, stat, "partial")
+            if digest is None:
+                pending.append((path, stat))
+            else:
+                digests[path] = digest
+
+        limit = HASH_PARTIAL_BYTES if kind == "partial" else None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(lambda item: hash_file(item[0], limit), pending)
+            for (path, stat), digest in zip(pending, results):
+                if digest is None:
+                    continue
+                digests[path] = digest
+                self.cache.put(path, stat, kind, digest)
+        return digests
+
+    def _split(
+        self, groups: list[list[tuple[Path, os.stat_result]]], digests: dict[Path, str]
+    ) -> list[list[tuple[Path, os.stat_result]]]:
+        split_groups = []
+        for group in groups:
+            buckets: dict[str, list[tuple[Path, os.stat_result]]] = {}
+            for item in group:
+                if item[0] in digests:
+                    buckets.setdefault(digests[item[0]], []).append(item)
+            split_groups.extend(bucket for bucket in buckets.values() if len(bucket) > 1)
+        return split_groups
+
+
+def hash_file(path: Path, limit: Optional[int] = None) -> Optional[str]:
+    """Hash the first `limit` bytes of a file, or all of it. Returns None if it cannot be read."""
+    digest = hashlib.blake2b()
+    remaining = limit
+    try:
+        with open(path, "rb") as file:
+            while remaining is None or remaining > 0:
+                size = COPY_BUFSIZE if remaining is None else min(COPY_BUFSIZE, remaining)
+                chunk = file.read(size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                if remaining is not None:
+                    remaining -= len(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
@@ -0,0 +1,115 @@
+import json
+import os
+from pathlib import Path
+from typing import Iterable
+
+from p5d.utils import scan_dir
+
+
+class RemoteManifest:
+    """
+    Cached listing of remote folder trees, size and mtime of every file.
+
+    Every directory is stored with its mtime. A directory whose mtime still matches has not
+    gained or lost entries since it was listed, so its files and subfolders are taken from the
+    cache and the directory costs one stat instead of a listing. Files changed in place keep
+    their cached size and mtime, which is fine for append-only libraries synced with
+    `--ignore-existing` semantics.
+
+    Args:
+        state_path (str | Path): JSON file that stores the manifests.
+    """
+
+    def __init__(self, state_path: str | Path):
+        self.state_path = Path(state_path)
+        # root -> relative directory -> [mtime_ns, {name: [size, mtime_ns]}, [subfolder names]]
+        self.state: dict[str, dict[str, list]] = self._load()
+
+    def scan(self, root: str | Path, recursive: bool = True) -> dict[str, tuple[int, int]]:
+        """
+        Return the files below root as relative POSIX path to (size, mtime_ns).
+
+        Only directories whose mtime changed since the last scan are listed. A non-recursive scan
+        returns the top-level files and keeps the cached subfolders as they are.
+        """
+        root = Path(root)
+        cached = self.state.get(str(root), {})
+        tree: dict[str, list] = {} if recursive else dict(cached)
+        files: dict[str, tuple[int, int]] = {}
+        pending = [""]
+        while pending:
+            rel_dir = pending.pop()
+            try:
+                mtime_ns = os.stat(root / rel_dir).st_mtime_ns
+            except OSError:
+                continue
+            entry = cached.get(rel_dir)
+            if entry is None or entry[0] != mtime_ns:
+                entry = self._list(root / rel_dir, mtime_ns)
+            tree[rel_dir] = entry
+            for name, (size, file_mtime) in entry[1].items():
+                files[_join(rel_dir, name)] = (size, file_mtime)
+            if recursive:
+                pending.extend(_join(rel_dir, name) for name in entry[2])
+        self.state[str(root)] = tree
+        return files
+
+    def record(self, root: str | Path, copied: Iterable[tuple[str, int, int]]) -> None:
+        """
+        Add files copied to root by P5D, as (relative path, size, mtime_ns).
+
+        The mtime of their directories is taken again, so the copies do not force a listing on
+        the next scan.
+        """
+        root = Path(root)
+        tree = self.state.setdefault(str(root), {})
+        touched: set[str] = set()
+        for rel_path, size, mtime_ns in copied:
+            rel_dir, _, name = rel_path.rpartition("/")
+            self._add_dir(tree, rel_dir, touched)
+            tree[rel_dir][1][name] = [size, mtime_ns]
+            touched.add(rel_dir)
+        for rel_dir in touched:
+            try:
+                tree[rel_dir][0] = os.stat(root / rel_dir).st_mtime_ns
+            except OSError:
+                continue
+
+    def _add_dir(self, tree: dict[str, list], rel_dir: str, touched: set[str]) -> None:
+        if rel_dir in tree:
+            return
+        tree[rel_dir] = [0, {}, []]
+        if rel_dir:
+            parent, _, folder = rel_dir.rpartition("/")
+            self._add_dir(tree, parent, touched)
+            tree[parent][2].append(folder)
+            touched.add(parent)
+
+    def save(self) -> None:
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.state_path, "w", encoding="utf-8") as file:
+            json.dump(self.state, file, ensure_ascii=False)
+
+    def _list(self, directory: Path, mtime_ns: int) -> list:
+        files, subdirs = {}, []
+        for entry in scan_dir(directory):
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            elif entry.is_file():
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+        return [mtime_ns, files, subdirs]
+
+    def _load(self) -> dict[str, dict[str, list]]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+
+def _join(rel_dir: str, name: str) -> str:
+    return f"{rel_dir}/{name}" if rel_dir else name
@@ -0,0 +1,205 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+
+from p5d.app_settings import MOVE_WORKERS
+from p5d.utils import DirectorySnapshot, move_file, name_key, scan_dir, unique_path
+
+
+class MoveTask(NamedTuple):
+    """
+    One entry of a move plan.
+
+    Attributes:
+        src: Source file path.
+        dst: Destination file path, after collision renaming.
+        resolver: Name of the path resolver that produced the destination.
+        tag: The file tag matched by the resolver, empty if none.
+        renamed_from: Original destination file name if it was renamed, otherwise empty.
+        category: The category the file belongs to.
+    """
+
+    src: Path
+    dst: Path
+    resolver: str = ""
+    tag: str = ""
+    renamed_from: str = ""
+    category: str = ""
+
+
+class NameIndex:
+    """
+    File names per destination directory, stored as `utils.name_key`.
+
+    Each directory is read from the directory snapshot once, names are added as moves are
+    planned, so unique names are assigned in memory instead of probing with `exists()`.
+    """
+
+    def __init__(self, snapshot: DirectorySnapshot):
+        self.snapshot = snapshot
+        self.names: dict[Path, set[str]] = {}
+
+    def claim(self, path: Path) -> Path:
+        """Reserve the name of path in its directory, renamed to `stem-N` if it is taken."""
+        names = self.names.get(path.parent)
+        if names is None:
+            exists = self.snapshot.is_dir(path.parent)
+            listing = self.snapshot.listing(path.parent) if exists else []
+            names = {name_key(name) for name in listing}
+            self.names[path.parent] = names
+        if name_key(path.name) in names:
+            path = unique_path(path, names)
+        names.add(name_key(path.name))
+        return path
+
+
+class MoveExecutor:
+    """
+    Move files in bulk, grouped by destination directory.
+
+    `plan` resolves name collisions in memory with a NameIndex without touching the filesystem,
+    `execute` creates each destination directory once and runs the renames on a bounded thread
+    pool. Per-file results are logged in the same format as `utils.safe_move`, tasks that
+    succeeded are collected in `moved`.
+
+    Args:
+        logger (logging.Logger): A logging instance to use for logging messages.
+        snapshot (DirectorySnapshot, optional): Listings shared with the path resolvers.
+        max_workers (int, optional): Number of concurrent moves, defaults to MOVE_WORKERS.
+        fsync (bool, optional): Flush files copied across devices to disk, defaults to False.
+    """
+
+    def __init__(
+        self,
+        logger: logging.Logger,
+        snapshot: Optional[DirectorySnapshot] = None,
+        max_workers: int = MOVE_WORKERS,
+        fsync: bool = False,
+    ):
+        self.logger = logger
+        self.name_index = NameIndex(snapshot or DirectorySnapshot())
+        self.max_workers = max(1, max_workers)
+        self.fsync = fsync
+        self.moved: list[MoveTask] = []
+
+    def run(self, tasks: Iterable[tuple[Path, Path] | MoveTask]) -> int:
+        """
+        Move every (source, destination) pair and return the number of files moved.
+        """
+        return self.execute(self.plan(tasks))
+
+    def plan(self, tasks: Iterable[tuple[Path, Path] | MoveTask]) -> list[MoveTask]:
+        """Build the move plan, destinations that clash are renamed to `stem-N`."""
+        planned = []
+        for group in self.group(tasks).values():
+            for task in group:
+                self.logger.debug(f"Processing source file: {task.src}")
+                dst = self.name_index.claim(task.dst)
+                if dst != task.dst:
+                    self.logger.info(
+                        f"Destination file already exists. It will be renamed to {dst}."
+                    )
+                    task = task._replace(dst=dst, renamed_from=task.dst.name)
+                planned.append(task)
+        return planned
+
+    def execute(self, plan: Iterable[MoveTask], verify: bool = False) -> int:
+        """
+        Execute a move plan and return the number of files moved.
+
+        Set `verify` for plans built earlier, destinations that have been taken since then are
+        renamed again. Each destination directory is listed once for the check.
+        """
+        tasks: list[MoveTask] = []
+        for dst_dir, group in self.group(plan).items():
+            if not self._prepare_dir(dst_dir):
+                continue
+            if verify:
+                group = self._verify_names(dst_dir, group)
+            tasks.extend(group)
+
+        if not tasks:
+            return 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(lambda task: self._move(task.src, task.dst), tasks))
+        moved = [task for task, result in zip(tasks, results) if result]
+        self.moved.extend(moved)
+        return len(moved)
+
+    def group(self, tasks: Iterable[tuple[Path, Path] | MoveTask]) -> dict[Path, list[MoveTask]]:
+        groups: dict[Path, list[MoveTask]] = {}
+        for task in tasks:
+            task = MoveTask(Path(task[0]), Path(task[1]), *task[2:])
+            if task.src == task.dst:
+                continue
+            groups.setdefault(task.dst.parent, []).append(task)
+        return groups
+
+    def _prepare_dir(self, dst_dir: Path) -> bool:
+        """Create the destination directory once, return False on failure."""
+        if self.name_index.snapshot.is_dir(dst_dir):
+            return True
+        try:
+            dst_dir.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            self.logger.error(f"Error occurred while creating folder '{dst_dir}': {e}")
+            return False
+        return True
+
+    def _verify_names(self, dst_dir: Path, group: list[MoveTask]) -> list[MoveTask]:
+        existing = {name_key(name) for name in scan_names(dst_dir)}
+        taken = existing | {name_key(task.dst.name) for task in group}
+        verified = []
+        for task in group:
+            if name_key(task.dst.name) in existing:
+                dst = unique_path(task.dst, taken)
+                taken.add(name_key(dst.name))
+                self.logger.info(f"Destination file already exists. It will be renamed to {dst}.")
+                task = task._replace(dst=dst, renamed_from=task.renamed_from or task.dst.name)
+            verified.append(task)
+        return verified
+
+    def _move(self, src: Path, dst: Path) -> bool:
+        try:
+            move_file(src, dst, self.fsync)
+            self.logger.debug(f"Successfully move file to {dst}.")
+            return True
+        except FileNotFoundError:
+            self.logger.info(f"Source '{src}' does not exist, skip this file move")
+        except PermissionError:
+            self.logger.error(f"Permission denied when moving '{src}' to '{dst}'.")
+        except Exception as e:
+            self.logger.error(f"Error occurred while moving '{src}' to '{dst}': {e}")
+        return False
+
+
+def scan_names(directory: Path) -> list[str]:
+    return [entry.name for entry in scan_dir(directory)]
+
+
+def write_plan(plan: Iterable[MoveTask], cleanup: Iterable[Path], file_path: Path) -> int:
+    """
+    Write a move plan as JSON lines and return the number of tasks.
+
+    The first line holds the folders to remove after the plan is applied, every following line
+    is one MoveTask stored as an array.
+    """
+    count = 0
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"cleanup": [str(path) for path in cleanup]}, ensure_ascii=False))
+        f.write("\n")
+        for task in plan:
+            row = [str(task.src), str(task.dst), *task[2:]]
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def read_plan(file_path: Path) -> tuple[list[MoveTask], list[Path]]:
+    with open(file_path, "r", encoding="utf-8") as f:
+        header = json.loads(f.readline() or "{}")
+        plan = [MoveTask(Path(row[0]), Path(row[1]), *row[2:]) for row in map(json.loads, f)]
+    return plan, [Path(path) for path in header.get("cleanup", [])]
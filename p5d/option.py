@@ -30,7 +30,15 @@ def build_parser():
     parser.add_argument("--no-view", action="store_true", help="關閉統計標籤功能")
     parser.add_argument("--no-archive", action="store_true", help="關閉日誌功能")
     parser.add_argument("--download", action="store_true", help="尋回遺失作品後自動下載")
+    parser.add_argument(
+        "--retrieve-api", action="store_true", help="以 Danbooru JSON API 批次尋找遺失作品"
+    )
     parser.add_argument("--direct_sync", action="store_true", help="跳過本地分類直接映射到遠端目錄")
+    parser.add_argument("--full-rescan", action="store_true", help="忽略增量紀錄重新掃描所有資料夾")
+    parser.add_argument("--plan", action="store_true", help="只產生分類計畫，不移動檔案")
+    parser.add_argument("--apply-plan", action="store_true", help="執行已儲存的分類計畫")
+    parser.add_argument("--watch", action="store_true", help="持續監看下載資料夾，自動分類新檔案")
+    parser.add_argument("--rebuild-catalog", action="store_true", help="重新掃描資料夾建立作品目錄")
     parser.add_argument(
         "--stats_dir",
         type=str,
@@ -65,6 +73,8 @@ def build_parser():
     # Convert list[tuple[str, str]] to dict[str, str]
     args.options = dict(args.options) if args.options else {}
 
+    if args.plan:
+        args.no_sync = True
     if args.direct_sync:
         args.no_categorize = False
         args.stats_dir = "remote_path"
@@ -1,33 +1,141 @@
+import itertools
+import json
 import logging
 import random
+import shutil
 import sys
-import time
+import tempfile
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode
 from pathlib import Path
-from typing import Optional, Any, Callable
+from typing import Optional, Any, Callable, Iterable, Iterator, TextIO
 
 import requests
 from lxml import html
 
 from p5d import custom_logger
-from p5d.app_settings import RETRIEVE_DIR, MISS_LOG, DANBOORU_SEARCH_URL
-
-
-progress_lock = threading.Lock()
-progress_idx = -1
-
-
-def retrieve_artwork(logger: logging.Logger, download: bool = False) -> None:
+from p5d.catalog import ArtworkCatalog
+from p5d.app_settings import (
+    RETRIEVE_DIR,
+    MISS_LOG,
+    DANBOORU_API_FIELDS,
+    DANBOORU_API_LIMIT,
+    DANBOORU_API_URL,
+    DANBOORU_SEARCH_URL,
+    RETRIEVE_BATCH,
+    RETRIEVE_CACHE,
+    RETRIEVE_CHUNK,
+    RETRIEVE_JITTER,
+    RETRIEVE_MAX_RATE,
+    RETRIEVE_MIN_RATE,
+    RETRIEVE_NEGATIVE_TTL,
+    RETRIEVE_POSITIVE_TTL,
+    RETRIEVE_RATE,
+    RETRIEVE_RATE_STEP,
+    RETRIEVE_TIMEOUT,
+    RETRIEVE_WORKERS,
+    TEMP_DIR,
+)
+
+# Lookups that found no visible posts, cached with the negative TTL
+NEGATIVE_RESULTS = ("No posts found.", "Hidden posts")
+
+
+def retrieve_artwork(
+    logger: logging.Logger,
+    download: bool = False,
+    catalog: Optional[ArtworkCatalog] = None,
+    api: bool = False,
+) -> None:
+    """
+    Look up the artworks of the missing list and write the posts found to the output file.
+
+    The missing list is read in chunks of RETRIEVE_CHUNK ids, each checked against the catalog
+    and the lookup cache before the rest is fetched, so only the set of ids already seen grows
+    with the list. Every final result, posts found, no posts or hidden posts, is appended to a
+    JSONL checkpoint as soon as it arrives, so an interrupted run resumes with the ids that are
+    not in the checkpoint yet. Errors go to a temporary file instead. The output is rendered from
+    the checkpoint and the errors once all ids are tried, then the checkpoint is removed unless
+    there were errors, so the next run only retries the failed ids.
+    """
     base_dir = Path(__file__).resolve().parents[1]
     file_path = base_dir / RETRIEVE_DIR / f"{MISS_LOG}.txt"
     output_path = Path(RETRIEVE_DIR) / f"{MISS_LOG}_retrieve.txt"
-    suffix = " 404 not found\n"
+    checkpoint_path = base_dir / RETRIEVE_DIR / f"{MISS_LOG}_checkpoint.jsonl"
     try:
-        with open(file_path, "r", encoding="utf-8") as file:
-            pixiv_ids = [line.rstrip(suffix) for line in file if line.endswith(suffix)]
-        results = fetch_all(pixiv_ids, danbooru, logger)
-        write_retrieve_results(results, output_path)
+        # The only state that grows with the list, needed to skip done and repeated ids
+        seen = {pixiv_id for pixiv_id, _ in read_checkpoint(checkpoint_path)}
+        if seen:
+            logger.info(f"Resume retrieving, {len(seen)} artworks are already done")
+        cache = LookupCache(base_dir / TEMP_DIR / RETRIEVE_CACHE)
+        counts = {"catalog": 0, "cache": 0, "errors": 0}
+        with (
+            open_checkpoint(checkpoint_path) as checkpoint,
+            tempfile.TemporaryFile("w+", encoding="utf-8") as errors,
+        ):
+
+            def record(results: dict[str, Any]) -> None:
+                cache.put_many(results)
+                for pixiv_id, result in results.items():
+                    line = json.dumps({"pixiv_id": pixiv_id, "result": result}, ensure_ascii=False)
+                    if is_final(result):
+                        checkpoint.write(line + "\n")
+                    else:
+                        errors.write(line + "\n")
+                        counts["errors"] += 1
+                checkpoint.flush()
+
+            def pending_ids() -> Iterator[str]:
+                """New ids in chunks of RETRIEVE_CHUNK, cached results are recorded on the way."""
+                for chunk in iter_chunks(read_missing_ids(file_path), RETRIEVE_CHUNK):
+                    lookups = []
+                    for pixiv_id in chunk:
+                        if pixiv_id in seen:
+                            continue
+                        seen.add(pixiv_id)
+                        if catalog is not None and catalog.has_pixiv_id(pixiv_id):
+                            counts["catalog"] += 1
+                        else:
+                            lookups.append(pixiv_id)
+                    cached = cache.get_many(lookups)
+                    if cached:
+                        counts["cache"] += len(cached)
+                        record(cached)
+                    yield from (pixiv_id for pixiv_id in lookups if pixiv_id not in cached)
+
+            try:
+                if api:
+                    fetch_all(
+                        pending_ids(),
+                        danbooru_batch,
+                        logger,
+                        batch_size=RETRIEVE_BATCH,
+                        on_result=record,
+                    )
+                else:
+                    fetch_all(pending_ids(), danbooru, logger, on_result=record)
+            finally:
+                cache.save()
+            if counts["catalog"]:
+                logger.info(f"Skip {counts['catalog']} artworks found in the catalog")
+            if counts["cache"]:
+                logger.info(f"Skip {counts['cache']} artworks looked up recently")
+
+            errors.seek(0)
+            write_retrieve_results(
+                itertools.chain(read_checkpoint(checkpoint_path), read_results(errors)),
+                output_path,
+            )
+        if counts["errors"]:
+            logger.info(
+                f"Failed to retrieve {counts['errors']} artworks, they are retried next run"
+            )
+        else:
+            checkpoint_path.unlink()
         logger.debug(f"Retrieving result written to '{output_path}'")
 
     except FileNotFoundError:
@@ -39,29 +147,184 @@ def retrieve_artwork(logger: logging.Logger, download: bool = False) -> None:
         danbooru_downloader(output_path, base_dir, logger)
 
 
+def is_final(result: Any) -> bool:
+    """Posts found, no posts or hidden posts, anything else is an error worth retrying."""
+    return isinstance(result, list) or result in NEGATIVE_RESULTS
+
+
+def read_missing_ids(file_path: Path) -> Iterator[str]:
+    """Yield the pixiv ids of the missing list, one line at a time."""
+    suffix = " 404 not found\n"
+    with open(file_path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.endswith(suffix):
+                yield line.removesuffix(suffix)
+
+
+def read_checkpoint(checkpoint_path: Path) -> Iterator[tuple[str, Any]]:
+    """Yield (pixiv_id, result) of a checkpoint, a line cut off by a crash is skipped."""
+    try:
+        file = open(checkpoint_path, "r", encoding="utf-8")
+    except FileNotFoundError:
+        return
+    with file:
+        yield from read_results(file)
+
+
+def read_results(file: TextIO) -> Iterator[tuple[str, Any]]:
+    for line in file:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        yield entry["pixiv_id"], entry["result"]
+
+
+def open_checkpoint(checkpoint_path: Path) -> TextIO:
+    """Open a checkpoint for appending, starting on a new line after a cut off line."""
+    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+    file = open(checkpoint_path, "a+", encoding="utf-8")
+    if file.tell():
+        file.seek(file.tell() - 1)
+        if file.read(1) != "\n":
+            file.write("\n")
+    return file
+
+
+class LookupCache:
+    """
+    Retriever results persisted between runs, keyed by pixiv id.
+
+    Found posts are kept for `positive_ttl` seconds. "No posts found." and "Hidden posts" are
+    kept for the shorter `negative_ttl`, as posts may still be uploaded or unhidden. Errors are
+    never cached, expired entries are dropped when the cache is saved.
+
+    Args:
+        cache_path (str | Path): JSON file that stores the results.
+        positive_ttl (float, optional): Lifetime of found posts, defaults to RETRIEVE_POSITIVE_TTL.
+        negative_ttl (float, optional): Lifetime of missing posts, defaults to
+            RETRIEVE_NEGATIVE_TTL.
+    """
+
+    def __init__(
+        self,
+        cache_path: str | Path,
+        positive_ttl: float = RETRIEVE_POSITIVE_TTL,
+        negative_ttl: float = RETRIEVE_NEGATIVE_TTL,
+    ):
+        self.cache_path = Path(cache_path)
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        # pixiv id -> [lookup time, result]
+        self.entries: dict[str, list] = self._load()
+        self.dirty = False
+
+    def get_many(self, pixiv_ids: Iterable[str]) -> dict[str, Any]:
+        """Results of the ids with an entry that has not expired."""
+        now = time.time()
+        results = {}
+        for pixiv_id in pixiv_ids:
+            entry = self.entries.get(pixiv_id)
+            if entry is not None and not self._expired(entry, now):
+                results[pixiv_id] = entry[1]
+        return results
+
+    def put_many(self, results: dict[str, Any]) -> None:
+        now = time.time()
+        for pixiv_id, result in results.items():
+            if is_final(result):
+                self.entries[pixiv_id] = [now, result]
+                self.dirty = True
+
+    def save(self) -> None:
+        """Write the cache, expired entries are dropped first."""
+        now = time.time()
+        expired = [key for key, entry in self.entries.items() if self._expired(entry, now)]
+        for key in expired:
+            del self.entries[key]
+        if not self.dirty and not expired:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.cache_path, "w", encoding="utf-8") as file:
+            json.dump(self.entries, file, ensure_ascii=False)
+        self.dirty = False
+
+    def _expired(self, entry: list, now: float) -> bool:
+        ttl = self.positive_ttl if isinstance(entry[1], list) else self.negative_ttl
+        return now - entry[0] >= ttl
+
+    def _load(self) -> dict[str, list]:
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+
 def fetch_all(
-    pixiv_ids: list[str],
+    pixiv_ids: Iterable[str],
     fetch_func: Callable,
     logger: logging.Logger,
-    max_workers: int = 5,
+    max_workers: int = RETRIEVE_WORKERS,
+    governor: Optional["RateGovernor"] = None,
+    batch_size: int = 1,
+    on_result: Optional[Callable[[dict[str, Any]], None]] = None,
 ) -> dict[str, str]:
-    results = {}
-    max_workers = 32 if max_workers > 32 else max_workers
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {
-            executor.submit(fetch_func, pixiv_id, logger): pixiv_id for pixiv_id in pixiv_ids
-        }
-        for future in as_completed(futures):
-            pixiv_id = futures[future]
-
-            if logger.getEffectiveLevel() > logging.DEBUG:
-                update_progress(len(pixiv_ids))
-            try:
-                data = future.result()
-                if data:
-                    results.update(data)
-            except Exception as exc:
-                logger.error(f"{pixiv_id} generated an exception: {exc}")
+    """
+    Run `fetch_func(pixiv_id, logger, session=session, governor=governor)` for every id and
+    merge the results. With a `batch_size` above one, fetch_func gets lists of up to
+    `batch_size` ids instead. With `on_result`, every result is handed to it as it completes
+    instead of being merged, and an empty dict is returned.
+
+    Lookups run on a thread pool with at most two per worker submitted at a time. Ids are taken
+    from `pixiv_ids` only as lookups finish, so an iterator is never read ahead and with
+    `on_result` the memory does not grow with the number of ids. Each worker
+    thread keeps its own requests.Session, so connections to the source site are kept alive and
+    reused instead of opening a new TCP and TLS connection per id. All workers share one
+    RateGovernor, so a rate limit slows down all of them together.
+    """
+    max_workers = min(max(1, max_workers), 32)
+    governor = governor or RateGovernor()
+    total = None
+    if isinstance(pixiv_ids, list):
+        total = -(-len(pixiv_ids) // max(1, batch_size))
+    items = iter_chunks(pixiv_ids, batch_size) if batch_size > 1 else iter(pixiv_ids)
+    sessions = ThreadSessions()
+    results: dict[str, Any] = {}
+
+    def fetch(item: Any) -> dict[str, Any]:
+        return fetch_func(item, logger, session=sessions.get(), governor=governor)
+
+    running: dict[Future, Any] = {}
+    done = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                for item in itertools.islice(items, max_workers * 2 - len(running)):
+                    running[executor.submit(fetch, item)] = item
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    item = running.pop(future)
+                    try:
+                        data = future.result()
+                    except Exception as exc:
+                        logger.error(f"{item} generated an exception: {exc}")
+                        # Reported as errors, the ids must not vanish from the results
+                        item_ids = item if isinstance(item, list) else [item]
+                        data = {pixiv_id: f"Lookup failed: {exc}" for pixiv_id in item_ids}
+                    if logger.getEffectiveLevel() > logging.DEBUG:
+                        print_progress(done, total)
+                    done += 1
+                    if not data:
+                        continue
+                    if on_result is not None:
+                        on_result(data)
+                    else:
+                        results.update(data)
+    finally:
+        sessions.close()
 
     # Clean terminal
     sys.stdout.write("\r")
@@ -70,11 +333,60 @@ def fetch_all(
     return results
 
 
+def iter_chunks(iterable: Iterable[Any], size: int) -> Iterator[list[Any]]:
+    """Yield lists of up to `size` items."""
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+class ThreadSessions:
+    """
+    One requests.Session per worker thread, a Session is not documented as thread-safe.
+
+    Sessions are created on first use in each thread and closed together by `close`.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.sessions: list[requests.Session] = []
+
+    def get(self) -> requests.Session:
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = make_session(1)
+            self.local.session = session
+            with self.lock:
+                self.sessions.append(session)
+        return session
+
+    def close(self) -> None:
+        with self.lock:
+            for session in self.sessions:
+                session.close()
+            self.sessions.clear()
+
+
+def make_session(pool_size: int) -> requests.Session:
+    """Session with a keep-alive connection pool of `pool_size` connections."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 def danbooru(
-    pixiv_id: str, logger: logging.Logger, retry: int = 5, sleep_time: int = 5
+    pixiv_id: str,
+    logger: logging.Logger,
+    retry: int = 5,
+    sleep_time: int = 5,
+    session: Optional[requests.Session] = None,
+    governor: Optional["RateGovernor"] = None,
 ) -> dict[str, str]:
     url = DANBOORU_SEARCH_URL.format(pixiv_id)
-    response = retry_request(url, logger, retry, sleep_time)
+    response = retry_request(url, logger, retry, sleep_time, session, governor)
 
     if response.status_code != 200:
         return {pixiv_id: f"HTTPS connection error with code {response.status_code}"}
@@ -82,25 +394,107 @@ def danbooru(
     return danbooru_fetcher(pixiv_id, response)
 
 
+def danbooru_batch(
+    pixiv_ids: list[str],
+    logger: logging.Logger,
+    retry: int = 5,
+    sleep_time: int = 5,
+    session: Optional[requests.Session] = None,
+    governor: Optional["RateGovernor"] = None,
+) -> dict[str, Any]:
+    """
+    Look up many pixiv ids with the posts JSON API of Danbooru.
+
+    One request searches all ids and only asks for the fields needed to tell them apart, the
+    posts are split back into the statuses of `danbooru_fetcher`: the post ids, "No posts
+    found." or "Hidden posts" when every post of the id is banned. A failed request marks all
+    ids of the batch with the error.
+    """
+    posts: list[dict[str, Any]] = []
+    page = 1
+    while True:
+        params = {
+            "tags": f"pixiv_id:{','.join(pixiv_ids)}",
+            "only": DANBOORU_API_FIELDS,
+            "limit": DANBOORU_API_LIMIT,
+            "page": page,
+        }
+        url = f"{DANBOORU_API_URL}?{urlencode(params)}"
+        response = retry_request(url, logger, retry, sleep_time, session, governor)
+        if response.status_code != 200:
+            error = f"HTTPS connection error with code {response.status_code}"
+            return {pixiv_id: error for pixiv_id in pixiv_ids}
+        try:
+            batch = response.json()
+        except ValueError:
+            return {pixiv_id: "Error: invalid JSON response" for pixiv_id in pixiv_ids}
+        posts.extend(batch)
+        if len(batch) < DANBOORU_API_LIMIT:
+            break
+        page += 1
+
+    by_id: dict[str, list[dict[str, Any]]] = {pixiv_id: [] for pixiv_id in pixiv_ids}
+    for post in posts:
+        pixiv_id = str(post.get("pixiv_id"))
+        if pixiv_id in by_id:
+            by_id[pixiv_id].append(post)
+
+    fetch_result: dict[str, Any] = {}
+    for pixiv_id, id_posts in by_id.items():
+        visible = [str(post["id"]) for post in id_posts if not post.get("is_banned")]
+        if visible:
+            fetch_result[pixiv_id] = visible
+        elif id_posts:
+            fetch_result[pixiv_id] = "Hidden posts"
+        else:
+            fetch_result[pixiv_id] = "No posts found."
+    return fetch_result
+
+
 def retry_request(
-    url: str, logger: logging.Logger, retries: int, sleep_time: int
+    url: str,
+    logger: logging.Logger,
+    retries: int,
+    sleep_time: int,
+    session: Optional[requests.Session] = None,
+    governor: Optional["RateGovernor"] = None,
 ) -> requests.Response:
+    """
+    GET url, retrying on HTTP 429.
+
+    With a governor every attempt waits for its turn and a 429 slows down all workers sharing
+    it, otherwise the attempt sleeps `sleep_time` or the Retry-After of the response.
+    """
     response = requests.Response()
     response.status_code = 500  # Default to an error status code
+    # The body is always read, so the connection goes back to the pool of the session
+    http = session or requests
     try:
         for attempt in range(retries):
-            response = requests.get(url, stream=True)
+            if governor is not None:
+                governor.acquire()
+            response = http.get(url, timeout=RETRIEVE_TIMEOUT)
             # Break if success (200), go to next iteration if (429), leave if any error.
             if response.status_code == 200:
+                if governor is not None:
+                    governor.success()
                 break
             elif response.status_code == 429:
-                time.sleep(sleep_time)
+                retry_after = parse_retry_after(response)
+                if governor is not None:
+                    delay = governor.throttle(retry_after)
+                else:
+                    delay = retry_after if retry_after is not None else sleep_time
+                    delay += random.uniform(0, delay * RETRIEVE_JITTER)
+                    time.sleep(delay)
                 logger.info(
-                    f"Rate limit exceeded for {url}. Sleeping for {sleep_time}s. Attempt {attempt + 1}/{retries}."
+                    f"Rate limit exceeded for {url}. Waiting for {delay:.1f}s. "
+                    f"Attempt {attempt + 1}/{retries}."
                 )
             else:
                 logger.error(f"Failed fetching for {url} with code {response.status_code}")
                 break
+        else:
             logger.error(f"Failed to retrieve URL after {retries} attempts: '{url}'")
     except requests.RequestException as e:
         logger.error(f"Failed to retrieve '{url}': {e}")
@@ -108,6 +502,96 @@ def retry_request(
     return response
 
 
+def parse_retry_after(response: requests.Response) -> Optional[float]:
+    """Seconds to wait from the Retry-After header, given as seconds or as an HTTP date."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        # A "-0000" zone parses to a naive datetime, HTTP dates are always UTC
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RateGovernor:
+    """
+    Request rate shared by all workers of a retrieval run.
+
+    A token bucket hands out one request every `1 / rate` seconds. A 429 halves the rate and
+    pauses every worker until the Retry-After of the response has passed, or for `backoff`
+    seconds without one, plus some jitter so the workers do not resume at once. Each success
+    raises the rate by `step` again, up to `max_rate`.
+
+    Args:
+        rate (float, optional): Initial requests per second, defaults to RETRIEVE_RATE.
+        max_rate (float, optional): Highest requests per second, defaults to RETRIEVE_MAX_RATE.
+        min_rate (float, optional): Lowest requests per second, defaults to RETRIEVE_MIN_RATE.
+        step (float, optional): Rate increase per success, defaults to RETRIEVE_RATE_STEP.
+        backoff (float, optional): Seconds to pause on a 429 without Retry-After.
+    """
+
+    def __init__(
+        self,
+        rate: float = RETRIEVE_RATE,
+        max_rate: float = RETRIEVE_MAX_RATE,
+        min_rate: float = RETRIEVE_MIN_RATE,
+        step: float = RETRIEVE_RATE_STEP,
+        backoff: float = 5,
+    ):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.step = step
+        self.backoff = backoff
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until the next request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    # Capacity of one token, a recovered rate does not start with a burst
+                    self.tokens = min(1.0, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.paused_until - now
+            time.sleep(wait)
+
+    def success(self) -> None:
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.step)
+
+    def throttle(self, retry_after: Optional[float] = None) -> float:
+        """Slow down after a 429 and return the seconds until requests resume."""
+        with self.lock:
+            now = time.monotonic()
+            delay = self.backoff if retry_after is None else retry_after
+            delay += random.uniform(0, delay * RETRIEVE_JITTER)
+            # Workers throttled during the same pause slow the rate down only once
+            if now >= self.paused_until:
+                self.rate = max(self.min_rate, self.rate / 2)
+            self.paused_until = max(self.paused_until, now + delay)
+            self.tokens = 0.0
+            self.updated = self.paused_until
+            return self.paused_until - now
+
+
 def danbooru_fetcher(pixiv_id: str, response: requests.Response) -> dict[str, str]:
     """
     Extract the response to get the artwork status.
@@ -245,41 +729,45 @@ def download_with_speed_limit(url: str, save_path: Path, speed_limit_kbps: int =
                 time.sleep(expected_time - elapsed_time)
 
 
-def write_retrieve_results(data: dict[str, str], filename: Path):
+def write_retrieve_results(
+    data: dict[str, Any] | Iterable[tuple[str, Any]], filename: Path
+) -> None:
+    """
+    Write found posts first, then the ids without posts, with hidden posts and with errors.
+
+    The results are read once, entries of the later sections wait in temporary files.
+    """
     base_url = "https://danbooru.donmai.us/posts/"
-    with open(filename, "w", encoding="utf-8") as file:
-        # Write list values first
-        for key, value in data.items():
-            if isinstance(value, list):
-                file.write(f"# {key}\n")
-                for post_id in value:
-                    file.write(f"{base_url}{post_id}\n")
-
-        # Write "no posts found" entries
-        for key, value in data.items():
-            if value == "No posts found.":
-                file.write(f"# {key} No posts found\n")
-
-        # Write "hidden posts" entries
-        for key, value in data.items():
-            if value == "Hidden posts":
-                file.write(f"# {key} Hidden posts\n")
-
-        # Write "retrieve error" entries
-        for key, value in data.items():
-            if not isinstance(value, list) and value not in ["No posts found.", "Hidden posts"]:
-                file.write(f"# {key} retrieve error: {value}\n")
-
-
-def update_progress(jobs: int) -> None:
-    global progress_idx
-    with progress_lock:
-        progress_idx += 1
-        print_progress(progress_idx, jobs)
-
-
-def print_progress(idx: int, total_urls: int, width: int = 50) -> None:
+    items = data.items() if isinstance(data, dict) else data
+    # "no posts found", "hidden posts" and "retrieve error" entries
+    sections = [tempfile.TemporaryFile("w+", encoding="utf-8") for _ in range(3)]
+    try:
+        with open(filename, "w", encoding="utf-8") as file:
+            for key, value in items:
+                if isinstance(value, list):
+                    file.write(f"# {key}\n")
+                    file.writelines(f"{base_url}{post_id}\n" for post_id in value)
+                elif value == "No posts found.":
+                    sections[0].write(f"# {key} No posts found\n")
+                elif value == "Hidden posts":
+                    sections[1].write(f"# {key} Hidden posts\n")
+                else:
+                    sections[2].write(f"# {key} retrieve error: {value}\n")
+            for section in sections:
+                section.seek(0)
+                shutil.copyfileobj(section, file)
+    finally:
+        for section in sections:
+            section.close()
+
+
+def print_progress(idx: int, total_urls: Optional[int], width: int = 50) -> None:
     sys.stdout.write("\r" + " " * (width + 20) + "\r")
+    if not total_urls:
+        # Streamed ids, the total is not known in advance
+        sys.stdout.write(f"{idx + 1} done")
+        sys.stdout.flush()
+        return
     progress = (idx + 1) / total_urls
     filled_length = int(width * progress)
     bar = "#" * filled_length + "-" * (width - filled_length)
@@ -1,101 +1,433 @@
 # Todo: Logging if remote path exists.
+import json
 import logging
 import os
+import re
+import shutil
 import subprocess
+import time
 from abc import ABC, abstractmethod
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime
 from pathlib import Path
-from typing import Any
+from typing import Any, NamedTuple, Optional
 
 from p5d import custom_logger
-from p5d.app_settings import RSYNC_TEMP_EXT, USER_OS, TEMP_DIR
-from p5d.utils import ConfigLoader, normalize_path, extract_opt
+from p5d.app_settings import (
+    MAPPING_FILE,
+    MAPPING_INDEX,
+    REMOTE_MANIFEST,
+    RSYNC_LOG_FORMAT,
+    RSYNC_TEMP_EXT,
+    STAGE_DIR,
+    SYNC_COPY_WORKERS,
+    SYNC_JOBS,
+    SYNC_JOBS_PER_DEVICE,
+    SYNC_SPLIT_DIRS,
+    SYNC_STATS,
+    SYNC_STRATEGIES,
+    USER_OS,
+    TEMP_DIR,
+)
+from p5d.catalog import ArtworkCatalog, walk_files
+from p5d.categorizer import read_mapping
+from p5d.deduper import Deduplicator
+from p5d.manifest import RemoteManifest
+from p5d.utils import (
+    ConfigLoader,
+    copy_file,
+    normalize_path,
+    reflink_file,
+    extract_opt,
+    get_device,
+    is_partial,
+    is_system,
+    scan_dir,
+)
+
+
+# Sent files in a log written with RSYNC_LOG_FORMAT, rsync may group the digits of the size
+SENT_FILE_PATTERN = re.compile(r"\] >f\S+ ([\d,.]+) (.+)$")
+
+
+class SyncJob(NamedTuple):
+    """
+    One rsync transfer scheduled by FileSyncer.
+
+    Attributes:
+        src: Local folder to send.
+        dst: Remote folder to send to.
+        log_path: rsync log file, merged by LogMerger.
+        exclude_path: rsync exclude file, None if nothing is excluded.
+        category: Category of the folder, jobs of a split folder share it.
+    """
+
+    src: Path
+    dst: Path
+    log_path: Path
+    exclude_path: Optional[Path] = None
+    category: str = ""
+
+
+class JobResult(NamedTuple):
+    """
+    Outcome of one SyncJob.
+
+    Attributes:
+        job: The job that ran.
+        error: Error message, None if the job succeeded.
+        sent: Paths of the files sent as written in the log file, relative to the transfer root.
+        size: Bytes of the files sent.
+        start: Start time, from `time.monotonic`.
+        end: End time, from `time.monotonic`.
+    """
+
+    job: SyncJob
+    error: Optional[str]
+    sent: list[str]
+    size: int
+    start: float
+    end: float
 
 
 class SyncStrategy(ABC):
     def __init__(self) -> None:
-        self.cmd_base = ["rsync", "-aq", "--ignore-existing", "--progress"]
+        # The file size is logged for the transfer statistics of FileSyncer
+        self.cmd_base = [
+            "rsync",
+            "-aq",
+            "--ignore-existing",
+            "--progress",
+            f"--log-file-format={RSYNC_LOG_FORMAT}",
+        ]
 
     @abstractmethod
-    def sync(self, src: Path, dst: Path, log_path: Path) -> None:
+    def sync(
+        self, src: Path, dst: Path, log_path: Path, exclude_path: Optional[Path] = None
+    ) -> None:
         pass
 
 
 class RsyncStrategy(SyncStrategy):
-    def __init__(self, rsync_param: list[str]) -> None:
+    """
+    Send folders with rsync.
+
+    With a RemoteManifest the new files are found locally and handed to rsync with
+    `--files-from`, so rsync does not walk the remote tree and a folder without new files is not
+    sent at all. The manifest is skipped with custom rsync parameters.
+
+    Args:
+        rsync_param (list[str]): Custom rsync parameters, replaces the default command.
+        manifest (RemoteManifest, optional): Cached remote listings, saved by FileSyncer.
+    """
+
+    def __init__(self, rsync_param: list[str], manifest: Optional[RemoteManifest] = None) -> None:
         super().__init__()
         self.rsync_param = rsync_param
-
-    def sync(self, src: Path, dst: Path, log_path: Path) -> None:
+        self.manifest = None if rsync_param else manifest
+
+    def sync(
+        self, src: Path, dst: Path, log_path: Path, exclude_path: Optional[Path] = None
+    ) -> None:
+        if self.manifest is not None:
+            self._sync_new(src, dst, log_path, exclude_path)
+            return
         cmd = self.cmd_base + [f"--log-file={log_path}", str(_add_slash(src)), str(dst)]
         if self.rsync_param:
-            cmd = ["rsync"] + self.rsync_param + [str(src), str(dst)]
+            # Custom parameters log too, the names then start with the folder name of src
+            log_options = [f"--log-file={log_path}", f"--log-file-format={RSYNC_LOG_FORMAT}"]
+            cmd = ["rsync"] + self.rsync_param + log_options + [str(src), str(dst)]
+        if exclude_path is not None:
+            cmd.insert(-2, f"--exclude-from={exclude_path}")
+
+        try:
+            subprocess.run(cmd, check=True, text=True, encoding="utf-8")
+        except subprocess.CalledProcessError as e:
+            raise SyncError(f"Synchronization failed: {e}")
 
+    def _sync_new(
+        self, src: Path, dst: Path, log_path: Path, exclude_path: Optional[Path] = None
+    ) -> None:
+        new_files = _new_files(self.manifest, src, dst, exclude_path)
+        if not new_files:
+            return
+        files_from = log_path.with_suffix(".files")
+        with open(files_from, "w", encoding="utf-8") as file:
+            file.writelines(f"{rel_path}\n" for rel_path in new_files)
+        cmd = self.cmd_base + [
+            f"--log-file={log_path}",
+            f"--files-from={files_from}",
+            str(_add_slash(src)),
+            str(dst),
+        ]
         try:
             subprocess.run(cmd, check=True, text=True, encoding="utf-8")
         except subprocess.CalledProcessError as e:
             raise SyncError(f"Synchronization failed: {e}")
+        finally:
+            files_from.unlink(missing_ok=True)
+
+        copied = []
+        for rel_path in new_files:
+            try:
+                stat = os.stat(dst / rel_path)
+            except OSError:
+                continue
+            copied.append((rel_path, stat.st_size, stat.st_mtime_ns))
+        self.manifest.record(dst, copied)
+
+
+class NativeSyncStrategy(SyncStrategy):
+    """
+    Copy new files without rsync.
+
+    The local folder is compared against a RemoteManifest of the destination and only files
+    missing on the remote are copied, on a thread pool with `utils.copy_file`. Files that exist
+    on the remote are never overwritten, the same as `--ignore-existing`. Each copy goes to a
+    temporary name first, so an interrupted run leaves no partial files. Sent files are written
+    to the log file in the itemized format of rsync.
+
+    When local and remote folder are on the same device, files can be linked instead of copied:
+        - "hard": hard links, the remote file is the local file.
+        - "reflink": copy-on-write clones, independent files that share the data blocks. Needs
+          a filesystem with reflink support such as Btrfs or XFS.
+    A file that cannot be linked is copied.
+
+    Args:
+        manifest (RemoteManifest): Cached remote listings, saved by FileSyncer after a run.
+        max_workers (int, optional): Number of concurrent copies, defaults to SYNC_COPY_WORKERS.
+        fsync (bool, optional): Flush copied files to disk, defaults to False.
+        link (str, optional): "hard" or "reflink" to link on a shared device, defaults to "".
+    """
+
+    def __init__(
+        self,
+        manifest: RemoteManifest,
+        max_workers: int = SYNC_COPY_WORKERS,
+        fsync: bool = False,
+        link: str = "",
+    ) -> None:
+        super().__init__()
+        self.manifest = manifest
+        self.max_workers = max(1, max_workers)
+        self.fsync = fsync
+        self.link = link
+
+    def sync(
+        self, src: Path, dst: Path, log_path: Path, exclude_path: Optional[Path] = None
+    ) -> None:
+        tasks = _new_files(self.manifest, src, dst, exclude_path)
+        for folder in {(dst / rel_path).parent for rel_path in tasks}:
+            folder.mkdir(parents=True, exist_ok=True)
+        link = self.link if self.link and _same_device(src, dst) else ""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(lambda rel: self._copy(src / rel, dst / rel, link), tasks))
+
+        # None marks a file that appeared on the remote meanwhile and was skipped
+        copied = [
+            (rel, *result) for rel, result in zip(tasks, results) if isinstance(result, tuple)
+        ]
+        self.manifest.record(dst, copied)
+        errors = [result for result in results if isinstance(result, str)]
+        self._write_log(log_path, copied, errors)
+        if errors:
+            raise SyncError(f"Synchronization failed: {len(errors)} files not copied, {errors[0]}")
+
+    def _copy(self, src: Path, dst: Path, link: str = "") -> Optional[tuple[int, int] | str]:
+        """
+        Copy or link one file, return its (size, mtime_ns), the error message, or None when a
+        file appeared at dst after the manifest scan and was left alone.
+        """
+        temp_path = dst.with_name(f".{dst.name}.p5d")
+        try:
+            if not (link and self._link(src, temp_path, link)):
+                copy_file(src, temp_path, self.fsync)
+            if not self._publish(temp_path, dst):
+                return None
+            stat = os.stat(dst)
+            return stat.st_size, stat.st_mtime_ns
+        except OSError as e:
+            return f"'{src}': {e}"
+        finally:
+            temp_path.unlink(missing_ok=True)
+
+    def _publish(self, temp_path: Path, dst: Path) -> bool:
+        """Give the finished temporary file its name without replacing an existing file."""
+        try:
+            # Fails if dst exists, os.replace would silently overwrite it
+            os.link(temp_path, dst)
+        except FileExistsError:
+            return False
+        except OSError:
+            # No hard links on the remote filesystem, checking first leaves a short race
+            if dst.exists():
+                return False
+            os.replace(temp_path, dst)
+        return True
+
+    def _link(self, src: Path, dst: Path, link: str) -> bool:
+        try:
+            if link == "hard":
+                os.link(src, dst)
+            else:
+                reflink_file(src, dst)
+        except OSError:
+            dst.unlink(missing_ok=True)
+            return False
+        return True
+
+    def _write_log(
+        self, log_path: Path, copied: list[tuple[str, int, int]], errors: list[str]
+    ) -> None:
+        timestamp = time.strftime("%Y/%m/%d %H:%M:%S")
+        pid = os.getpid()
+        with open(log_path, "a", encoding="utf-8") as file:
+            for rel_path, size, _ in copied:
+                file.write(f"{timestamp} [{pid}] >f+++++++++ {size} {rel_path}\n")
+            for error in errors:
+                file.write(f"{timestamp} [{pid}] copy failed {error}\n")
+            total = sum(size for _, size, _ in copied)
+            file.write(f"{timestamp} [{pid}] sent {total} bytes  received 0 bytes\n")
 
 
 class DirectSyncStrategy(SyncStrategy):
-    def __init__(self, rsync_param: list[str], config_loader: ConfigLoader):
+    def __init__(
+        self,
+        rsync_param: list[str],
+        config_loader: ConfigLoader,
+        catalog: Optional[ArtworkCatalog] = None,
+    ):
         super().__init__()
         self.rsync_param = rsync_param
         self.config_loader = config_loader
+        self.catalog = catalog
 
-    def sync(self, src: str | Path, dst: str | Path, log_path: Path) -> None:
-        while True:
-            dst = self._process_mapping_file()  # type: ignore
-            if dst is None:
-                break
-
-            Path(dst).mkdir(parents=True, exist_ok=True)
-            dst = normalize_path(_add_slash(dst))
-            mapping_file = normalize_path(
-                os.path.join(self.config_loader.base_dir, TEMP_DIR, "files.txt")
-            ).rstrip("/")
-
-            if not os.path.getsize(os.path.join(TEMP_DIR, "files.txt")):
-                break
-
-            cmd = self.cmd_base + ["--no-relative", f"--files-from={mapping_file}", "/", dst]
-            if self.rsync_param:
-                cmd = (
-                    ["rsync"]
-                    + self.rsync_param
-                    + ["--no-relative", f"--files-from={mapping_file}", "/", dst]
-                )
-
-            try:
-                subprocess.run(cmd, check=True, text=True, encoding="utf-8")
-            except subprocess.CalledProcessError as e:
-                raise SyncError(f"Synchronization failed: {e}")
-
-    def _process_mapping_file(self) -> str | None:
-        filename = os.path.join(TEMP_DIR, "mapping.txt")
-        with open(filename, "r", encoding="utf-8") as file:
-            lines = file.readlines()
-
-        key = None
-        values = []
-
-        for line in lines:
-            line = line.strip()
-            if line.startswith("[key]"):
-                if key is not None:
-                    break
-                key = line[5:]
-            elif line.startswith("[value]"):
-                values.append(line[7:])
+    def sync(
+        self,
+        src: str | Path,
+        dst: str | Path,
+        log_path: Path,
+        exclude_path: Optional[Path] = None,
+    ) -> None:
+        """
+        Send the whole mapping written by categorize_files.
+
+        Files are hard linked into a staging tree under local_path that mirrors their tagged
+        paths under remote_path, then sent with a single rsync. Destinations outside remote_path,
+        or all of them if the staging tree cannot be built, fall back to one rsync per
+        destination folder.
+        """
+        # Duplicates are already left out of the mapping by categorize_files
+        mapping_path = Path(self.config_loader.base_dir) / TEMP_DIR / MAPPING_FILE
+        if not mapping_path.exists():
+            return
+        groups = [(dst, files) for dst, files in read_mapping(mapping_path) if files]
+        base_paths = self.config_loader.get_base_paths()
+        remote_base = Path(base_paths["remote_path"])
+        stage_dir = Path(base_paths["local_path"]) / STAGE_DIR
+
+        staged = [(dst, files) for dst, files in groups if Path(dst).is_relative_to(remote_base)]
+        others = [
+            (dst, files) for dst, files in groups if not Path(dst).is_relative_to(remote_base)
+        ]
+        try:
+            if staged and not self._sync_staged(staged, remote_base, stage_dir):
+                others = staged + others
+            for dst, files_from in others:
+                self._sync_group(dst, files_from)
+        finally:
+            shutil.rmtree(stage_dir, ignore_errors=True)
+        # Consumed, a later sync without categorizing first must not send it again
+        mapping_path.unlink(missing_ok=True)
+        mapping_path.with_name(MAPPING_INDEX).unlink(missing_ok=True)
+
+    def _sync_staged(
+        self, groups: list[tuple[str, str]], remote_base: Path, stage_dir: Path
+    ) -> bool:
+        """Send every group with one rsync, return False if the staging tree cannot be built."""
+        shutil.rmtree(stage_dir, ignore_errors=True)
+        links: list[tuple[Path, Path]] = []
+        try:
+            for dst, files_from in groups:
+                folder = stage_dir / Path(dst).relative_to(remote_base)
+                folder.mkdir(parents=True, exist_ok=True)
+                for line in files_from.splitlines():
+                    src = Path(line)
+                    try:
+                        os.link(src, folder / src.name)
+                    except FileExistsError:
+                        # Same name for the same folder, the first one wins like --ignore-existing
+                        continue
+                    links.append((src, folder / src.name))
+        except OSError:
+            shutil.rmtree(stage_dir, ignore_errors=True)
+            return False
+        # Stat the staged files only, the ones skipped for a taken name are not sent
+        copies = []
+        if self.catalog is not None:
+            for src, link in links:
+                try:
+                    copies.append((remote_base / link.relative_to(stage_dir), os.stat(src)))
+                except OSError:
+                    continue
+
+        remote_base.mkdir(parents=True, exist_ok=True)
+        src_arg = normalize_path(_add_slash(stage_dir))
+        dst_arg = normalize_path(_add_slash(remote_base))
+        # Only the staged files are listed, the folders between them are created when missing but
+        # the times and permissions of existing remote folders are left alone
+        files_from = "".join(f"{link.relative_to(stage_dir).as_posix()}\n" for _, link in links)
+        options = ["--files-from=-", "--no-implied-dirs", src_arg, dst_arg]
+        cmd = self.cmd_base + options
+        if self.rsync_param:
+            cmd = ["rsync"] + self.rsync_param + options
+        try:
+            subprocess.run(cmd, input=files_from, check=True, text=True, encoding="utf-8")
+        except subprocess.CalledProcessError as e:
+            raise SyncError(f"Synchronization failed: {e}")
 
-        with open(os.path.join(TEMP_DIR, "files.txt"), "w", encoding="utf-8") as temp_file:
-            for value in values:
-                temp_file.write(value + "\n")
+        if "--remove-source-files" in self.rsync_param:
+            # rsync removed the staged links, remove the files they point to
+            for src, link in links:
+                if not link.exists():
+                    src.unlink(missing_ok=True)
+        if self.catalog is not None:
+            self.catalog.record_copies(copies)
+        return True
+
+    def _sync_group(self, dst: str, files_from: str) -> None:
+        Path(dst).mkdir(parents=True, exist_ok=True)
+        copies = self._list_copies(Path(dst), files_from)
+        dst = normalize_path(_add_slash(dst))
+        files_from = "".join(
+            f"{normalize_path(line).rstrip('/')}\n" for line in files_from.splitlines()
+        )
 
-        remaining_lines = lines[len(values) + 1 :]
+        # The file list of each destination is streamed to rsync on stdin
+        cmd = self.cmd_base + ["--no-relative", "--files-from=-", "/", dst]
+        if self.rsync_param:
+            cmd = ["rsync"] + self.rsync_param + ["--no-relative", "--files-from=-", "/", dst]
 
-        with open(filename, "w", encoding="utf-8") as file:
-            file.writelines(remaining_lines)
-        return key
+        try:
+            subprocess.run(cmd, input=files_from, check=True, text=True, encoding="utf-8")
+        except subprocess.CalledProcessError as e:
+            raise SyncError(f"Synchronization failed: {e}")
+        if self.catalog is not None:
+            self.catalog.record_copies(copies)
+
+    def _list_copies(self, dst: Path, files_from: str) -> list[tuple[Path, os.stat_result]]:
+        """Stat the sources before the transfer, rsync may remove them."""
+        if self.catalog is None:
+            return []
+        copies = []
+        for line in files_from.splitlines():
+            src = Path(line)
+            try:
+                copies.append((dst / src.name, os.stat(src)))
+            except OSError:
+                continue
+        return copies
 
 
 class FileSyncer:
@@ -105,59 +437,340 @@ class FileSyncer:
         logger: logging.Logger,
         direct_sync: bool = False,
         args: dict[str, Any] = {},
+        catalog: Optional[ArtworkCatalog] = None,
     ):
         self.logger = logger
         self.config_loader = config_loader
+        self.catalog = catalog
+        self.deduper = Deduplicator(config_loader, logger)
+        self.excludes: dict[Path, list[str]] = {}
         rsync_param = self._update_param(config_loader.get_custom(), args)
         rsync_param = extract_opt(rsync_param)
+        self.rsync_param = rsync_param
+        custom = config_loader.get_custom()
+        self.max_jobs = int(custom.get("sync_jobs", SYNC_JOBS))
+        self.max_jobs_per_device = int(custom.get("sync_jobs_per_device", SYNC_JOBS_PER_DEVICE))
+        self.split_dirs = int(custom.get("sync_split", SYNC_SPLIT_DIRS))
+        self.stats_path = config_loader.get_output_dir() / SYNC_STATS
+
+        strategy = custom.get("sync_strategy", "rsync")
+        if strategy not in SYNC_STRATEGIES:
+            logger.error(f"Unknown sync strategy '{strategy}', expected one of {SYNC_STRATEGIES}")
+            strategy = "rsync"
+        native = strategy != "rsync"
+        self.manifest = None
+        if not direct_sync and (native or custom.get("remote_manifest", True)):
+            manifest_path = Path(config_loader.base_dir) / TEMP_DIR / REMOTE_MANIFEST
+            self.manifest = RemoteManifest(manifest_path)
 
         if direct_sync:
-            self.sync_strategy = DirectSyncStrategy(rsync_param, config_loader)
+            self.sync_strategy = DirectSyncStrategy(rsync_param, config_loader, catalog)
+        elif native:
+            fsync = bool(custom.get("fsync", False))
+            link = {"link": "hard", "reflink": "reflink"}.get(strategy, "")
+            self.sync_strategy = NativeSyncStrategy(self.manifest, fsync=fsync, link=link)
         else:
-            self.sync_strategy = RsyncStrategy(rsync_param)
+            self.sync_strategy = RsyncStrategy(rsync_param, self.manifest)
 
     def sync_folders(self, src: Any, dst: Any) -> None:
         if not src:
             self.sync_folders_all()
-        else:
-            src, dst = Path(src), Path(dst)
-            if not isinstance(self.sync_strategy, DirectSyncStrategy):
-                if not src.is_dir():
-                    raise SyncError(f"Syncing file error: local folder '{src}' does not exist.")
-                if not dst.is_dir():
-                    self.logger.debug(f"Create nonexisting target folder '{str(dst)}'.")
-                    dst.mkdir(parents=True, exist_ok=True)
-
-            log_path = self._log_name(self.config_loader.base_dir / TEMP_DIR, src)
+        elif isinstance(self.sync_strategy, DirectSyncStrategy):
+            log_path = self._log_name(self.config_loader.base_dir / TEMP_DIR, Path(src).name)
             try:
                 self.sync_strategy.sync(src, dst, log_path)
             except SyncError as e:
                 self.logger.error(str(e))
+        else:
+            self.run_jobs(self.make_jobs(Path(src), Path(dst), Path(src).name))
 
     def sync_folders_all(self) -> None:
         combined_paths = self.config_loader.get_combined_paths()
+        if isinstance(self.sync_strategy, DirectSyncStrategy):
+            for key, paths in combined_paths.items():
+                if not paths.get("local_path"):
+                    self.logger.error(
+                        f"Local path of '{paths}' not found, continue to prevent infinite loop."
+                    )
+                    continue
+                self.sync_folders(paths["local_path"], paths["remote_path"])
+            return
+
+        local_paths = [paths["local_path"] for paths in combined_paths.values()]
+        self.excludes = self.deduper.excludes(path for path in local_paths if path)
+        jobs = []
         for key, paths in combined_paths.items():
             if not paths.get("local_path"):
                 self.logger.error(
                     f"Local path of '{paths}' not found, continue to prevent infinite loop."
                 )
                 continue
-            self.sync_folders(paths["local_path"], paths["remote_path"])
+            jobs.extend(self.make_jobs(Path(paths["local_path"]), Path(paths["remote_path"]), key))
+        self.run_jobs(jobs)
+
+    def make_jobs(self, src: Path, dst: Path, category: str = "") -> list[SyncJob]:
+        """
+        Build the rsync jobs of one folder.
+
+        A folder with at least `sync_split` top-level subfolders is sent as one job per subfolder
+        plus one for its top-level files. Folders are never split with custom rsync parameters,
+        which decide the destination layout themselves. Log files are named after the category,
+        so folders with the same name in different categories never share one.
+        """
+        if not src.is_dir():
+            raise SyncError(f"Syncing file error: local folder '{src}' does not exist.")
+        if not dst.is_dir():
+            self.logger.debug(f"Create nonexisting target folder '{str(dst)}'.")
+            dst.mkdir(parents=True, exist_ok=True)
+
+        log_dir = self.config_loader.base_dir / TEMP_DIR
+        log_key = category or src.name
+        excludes = self.excludes.get(src, [])
+        if excludes:
+            self.logger.info(f"Skip {len(excludes)} duplicate files of '{src}'")
+        subdirs = []
+        # Splitting overlaps the startup of rsync processes, custom parameters and the native
+        # strategy do not need it
+        if isinstance(self.sync_strategy, RsyncStrategy) and not self.rsync_param:
+            subdirs = [entry.name for entry in scan_dir(src) if entry.is_dir()]
+        if self.split_dirs <= 0 or len(subdirs) < self.split_dirs:
+            log_path = self._log_name(log_dir, log_key)
+            exclude_path = self._write_excludes(excludes, log_path)
+            return [SyncJob(src, dst, log_path, exclude_path, category)]
+
+        # Top-level files only, every subfolder gets its own job
+        log_path = self._log_name(log_dir, log_key)
+        top_excludes = [path for path in excludes if "/" not in path]
+        top_patterns = [f"/{_escape_pattern(path)}" for path in top_excludes] + ["/*/"]
+        top_exclude_path = self._write_patterns(top_patterns, log_path)
+        jobs = [SyncJob(src, dst, log_path, top_exclude_path, category)]
+        for subdir in subdirs:
+            log_path = self._log_name(log_dir, log_key, subdir)
+            prefix = f"{subdir}/"
+            sub_excludes = [path[len(prefix) :] for path in excludes if path.startswith(prefix)]
+            sub_src = src / subdir
+            exclude_path = self._write_excludes(sub_excludes, log_path)
+            jobs.append(SyncJob(sub_src, dst / subdir, log_path, exclude_path, category=category))
+        self.logger.debug(f"Split syncing '{src}' into {len(jobs)} jobs")
+        return jobs
+
+    def run_jobs(self, jobs: list[SyncJob]) -> int:
+        """
+        Run rsync jobs with up to `sync_jobs` at once and `sync_jobs_per_device` per destination
+        device. Errors are logged per job, return the number of failed jobs.
+
+        Jobs wait in one queue per device and are only submitted when their device has a free
+        slot, so a busy device never holds pool workers that jobs for other devices could use.
+        Transfer statistics of each category are appended to `stats_path`.
+        """
+        failed = 0
+        results = []
+        max_jobs = max(1, self.max_jobs)
+        per_device = max(1, self.max_jobs_per_device)
+        queues: dict[int, deque[SyncJob]] = {}
+        for job in jobs:
+            queues.setdefault(self._device_of(job.dst), deque()).append(job)
+        active: Counter = Counter()
+        running: dict[Future, int] = {}
+
+        with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+            while True:
+                for device, queue in queues.items():
+                    while queue and active[device] < per_device and len(running) < max_jobs:
+                        running[executor.submit(self._run_job, queue.popleft())] = device
+                        active[device] += 1
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    active[running.pop(future)] -= 1
+                    result = future.result()
+                    results.append(result)
+                    if result.error:
+                        self.logger.error(result.error)
+                        failed += 1
+                    # Files sent before a failure are on the remote too. Recorded here, the
+                    # catalog connection belongs to this thread
+                    self._record_sent(result)
+        if self.manifest is not None:
+            self.manifest.save()
+        self._write_stats(results)
+        return failed
+
+    def _run_job(self, job: SyncJob) -> JobResult:
+        self.logger.debug(f"Syncing '{job.src}' to '{job.dst}'")
+        # Only the lines of this run count, rsync appends to an existing log file
+        offset = job.log_path.stat().st_size if job.log_path.exists() else 0
+        error = None
+        start = time.monotonic()
+        try:
+            self.sync_strategy.sync(job.src, job.dst, job.log_path, job.exclude_path)
+        except SyncError as e:
+            error = f"{e} ('{job.src}')"
+        end = time.monotonic()
+        if job.exclude_path is not None:
+            job.exclude_path.unlink(missing_ok=True)
+        sent, size = parse_sync_log(job.log_path, offset)
+        return JobResult(job, error, sent, size, start, end)
+
+    def _write_stats(self, results: list[JobResult]) -> None:
+        """Append one record per category, split folders are summed over their jobs."""
+        categories: dict[str, list[JobResult]] = {}
+        for result in results:
+            categories.setdefault(result.job.category or result.job.src.name, []).append(result)
+        if not categories:
+            return
+
+        timestamp = datetime.now().isoformat(timespec="seconds")
+        records = []
+        for category, group in categories.items():
+            files = sum(len(result.sent) for result in group)
+            size = sum(result.size for result in group)
+            # Wall time of the category, its jobs run concurrently
+            elapsed = max(r.end for r in group) - min(r.start for r in group)
+            mb_per_s = size / elapsed / 1e6 if elapsed > 0 else 0.0
+            records.append(
+                {
+                    "time": timestamp,
+                    "category": category,
+                    "jobs": len(group),
+                    "failed": sum(1 for result in group if result.error),
+                    "files": files,
+                    "bytes": size,
+                    "elapsed": round(elapsed, 3),
+                    "mb_per_s": round(mb_per_s, 3),
+                }
+            )
+            if files:
+                self.logger.info(
+                    f"Sent {files} files ({size / 1e6:.1f} MB) of '{category}' "
+                    f"in {elapsed:.1f}s, {mb_per_s:.1f} MB/s"
+                )
+
+        self.stats_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.stats_path, "a", encoding="utf-8") as file:
+            file.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
 
-    def _log_name(self, output_dir: Path, src: Path) -> Path:
+    def _device_of(self, dst: Path) -> int:
+        # Split jobs may target folders rsync has not created yet
+        for path in [dst, *dst.parents]:
+            try:
+                return get_device(str(path))
+            except OSError:
+                continue
+        return -1
+
+    def _log_name(self, output_dir: Path, key: str, part: str = "") -> Path:
         if not output_dir.is_dir():
             output_dir.mkdir(parents=True, exist_ok=True)
             self.logger.debug(f"Creates folder '{output_dir}'")
-        return output_dir / f"{src.name}{RSYNC_TEMP_EXT}"
+        name = f"{key}-{part}" if part else key
+        return output_dir / f"{name}{RSYNC_TEMP_EXT}"
+
+    def _record_sent(self, result: JobResult) -> None:
+        """Record the files listed in the log of a job, one stat per file sent."""
+        if self.catalog is None or not result.sent:
+            return
+        job = result.job
+        # Without a trailing slash on src, custom parameters log names from its parent
+        src_root = job.src.parent if self.rsync_param else job.src
+        copies = []
+        for rel_path in result.sent:
+            try:
+                copies.append((job.dst / rel_path, os.stat(job.dst / rel_path)))
+            except OSError:
+                continue
+        self.catalog.record_copies(copies)
+        if "--remove-source-files" in self.rsync_param:
+            self.catalog.remove(src_root / rel_path for rel_path in result.sent)
+
+    def _write_excludes(self, excludes: list[str], log_path: Path) -> Optional[Path]:
+        """Write duplicates as an rsync exclude file, None if there are none."""
+        # Anchored to the transfer root so only the duplicate itself is excluded
+        return self._write_patterns([f"/{_escape_pattern(path)}" for path in excludes], log_path)
+
+    def _write_patterns(self, patterns: list[str], log_path: Path) -> Optional[Path]:
+        if not patterns:
+            return None
+        exclude_path = log_path.with_suffix(".exclude")
+        with open(exclude_path, "w", encoding="utf-8") as file:
+            file.writelines(f"{pattern}\n" for pattern in patterns)
+        return exclude_path
 
     def _update_param(self, file_input: dict[str, str], cmd_input: dict[str, str]) -> str:
         return cmd_input.get("rsync", "") or file_input.get("rsync", "") or ""
 
 
+def parse_sync_log(log_path: Path, offset: int = 0) -> tuple[list[str], int]:
+    """
+    List the files sent in a sync log file from `offset`.
+
+    Returns:
+        sent: Paths of the files sent, relative to the transfer root.
+        size: Total bytes of the files sent.
+    """
+    sent = []
+    size = 0
+    try:
+        with open(log_path, "r", encoding="utf-8", errors="replace") as file:
+            file.seek(offset)
+            for line in file:
+                match = SENT_FILE_PATTERN.search(line.rstrip("\n"))
+                if match:
+                    sent.append(match.group(2))
+                    size += int(re.sub(r"\D", "", match.group(1)) or 0)
+    except OSError:
+        return [], 0
+    return sent, size
+
+
 def _add_slash(path: str | Path) -> str:
     return rf"{path}\\" if USER_OS == "Windows" else f"{path}/"
 
 
+def _escape_pattern(path: str) -> str:
+    """Escape rsync wildcard characters, file names of artworks often contain brackets."""
+    return "".join(f"\\{char}" if char in "*?[\\" else char for char in path)
+
+
+def _new_files(
+    manifest: RemoteManifest, src: Path, dst: Path, exclude_path: Optional[Path] = None
+) -> list[str]:
+    """Files of src missing on dst, as relative POSIX paths, leaving out excluded files."""
+    excluded, top_level_only = _read_excludes(exclude_path)
+    remote = manifest.scan(dst, recursive=not top_level_only)
+    new_files = []
+    # Split jobs send the top-level files of a folder, its subfolders are other jobs
+    for entry in scan_dir(src) if top_level_only else walk_files(src):
+        if not entry.is_file() or is_system(entry.name) or is_partial(entry.name):
+            continue
+        rel_path = Path(entry.path).relative_to(src).as_posix()
+        if rel_path not in remote and rel_path not in excluded:
+            new_files.append(rel_path)
+    return new_files
+
+
+def _same_device(src: Path, dst: Path) -> bool:
+    try:
+        return get_device(str(src)) == get_device(str(dst))
+    except OSError:
+        return False
+
+
+def _read_excludes(exclude_path: Optional[Path]) -> tuple[set[str], bool]:
+    """Read an exclude file written by FileSyncer, return the paths and if subfolders are out."""
+    if exclude_path is None:
+        return set(), False
+    excluded, top_level_only = set(), False
+    with open(exclude_path, "r", encoding="utf-8") as file:
+        for line in file.read().splitlines():
+            if line == "/*/":
+                top_level_only = True
+            elif line:
+                excluded.add(re.sub(r"\\(.)", r"\1", line.lstrip("/")))
+    return excluded, top_level_only
+
+
 class SyncError(Exception):
     pass
 
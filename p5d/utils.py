@@ -1,22 +1,69 @@
 # Todo: Add more config check
+import errno
+import functools
+import json
 import logging
 import os
 import re
 import sys
 import shutil
 import string
+import unicodedata
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import Optional, Any, Callable, Iterable
+from typing import NamedTuple, Optional, Any, Callable, Iterable, Iterator
 import toml
 
-from p5d.app_settings import OUTPUT_DIR, RSYNC_TEMP_EXT, is_docker
+from p5d.app_settings import (
+    CASE_INSENSITIVE_FS,
+    OUTPUT_DIR,
+    PARTIAL_EXT,
+    RSYNC_TEMP_EXT,
+    USER_OS,
+    is_docker,
+)
 from p5d import custom_logger
 
+if USER_OS == "Linux":
+    import fcntl
+
 HIRAGANA_START = "\u3040"
 HIRAGANA_END = "\u309f"
 KATAKANA_START = "\u30a0"
 KATAKANA_END = "\u30ff"
 
+# Bytes per kernel-side copy call and per read/write of the userspace fallback
+COPY_CHUNK = 64 * 1024 * 1024
+COPY_BUFSIZE = 1024 * 1024
+# ioctl request that clones a file on Linux, from linux/fs.h
+FICLONE = 0x40049409
+# Device pairs that refused a rename, e.g. two bind mounts of the same disk
+CROSS_DEVICE_PAIRS: set[tuple[int, int]] = set()
+# Most entries safe_rmtree looks at before it keeps a folder
+RMTREE_CHECK_LIMIT = 64
+# Number of directories listed concurrently by walk_tree
+SCAN_WORKERS = 16
+
+
+class CategoryRoute(NamedTuple):
+    """
+    Compiled settings of one category.
+
+    Attributes:
+        local_path: Combined local folder of the category.
+        remote_path: Combined remote folder of the category.
+        resolver: Name of the path resolver that handles the category.
+        tags: NFKC-normalized tag alias to folder name.
+        children: Child folders whose files belong to the category.
+    """
+
+    local_path: Path
+    remote_path: Path
+    resolver: str
+    tags: dict[str, str]
+    children: tuple[Path, ...]
+
 
 class ConfigLoader:
     """
@@ -39,14 +86,17 @@ class ConfigLoader:
         self.config_path: Path = self.base_dir / config_path
         self.config = {}
         self.combined_paths: dict[str, dict[str, str]] = {}
+        self.routing_table: dict[str, CategoryRoute] = {}
         self.logger = logger
 
     def load_config(self):
         try:
             with open(self.config_path, "r", encoding="utf-8") as file:
                 self.config = toml.load(file)
-                self.config_check()
-                self.logger.debug("Configuration loaded successfully")
+            self.combined_paths = {}
+            self.routing_table = {}
+            self.config_check()
+            self.logger.debug("Configuration loaded successfully")
             if is_docker():
                 self.config["BASE_PATHS"]["local_path"] = "/mnt/local_path"
                 self.config["BASE_PATHS"]["remote_path"] = "/mnt/remote_path"
@@ -134,6 +184,35 @@ class ConfigLoader:
             }
         return combined_paths
 
+    def get_routing_table(self) -> dict[str, CategoryRoute]:
+        """
+        Get the compiled routing table, one CategoryRoute per category.
+
+        The table is compiled once per effective configuration, including options given on the
+        command line, and kept until the config is loaded or updated again.
+
+        Returns:
+            routing_table: Category name to its CategoryRoute, in config order.
+        """
+        if not self.routing_table:
+            self.routing_table = self.compile_routes()
+        return self.routing_table
+
+    def compile_routes(self) -> dict[str, CategoryRoute]:
+        combined_paths = self.get_combined_paths()
+        routing_table = {}
+        for category, data in self.get_categories().items():
+            tags = data.get("tags", {})
+            local_path = Path(combined_paths[category]["local_path"])
+            routing_table[category] = CategoryRoute(
+                local_path=local_path,
+                remote_path=Path(combined_paths[category]["remote_path"]),
+                resolver=get_resolver_name(category, data),
+                tags={normalize_tag(alias): folder for alias, folder in tags.items()},
+                children=tuple(local_path.parent / child for child in data.get("children", [])),
+            )
+        return routing_table
+
     def update_config(self, options: dict[str, Any]):
         """
         Updates the configuration with the provided options.
@@ -243,9 +322,22 @@ class ConfigLoader:
             elif key == "stats_dir":
                 self.config[key] = options[key]
 
+        self.combined_paths = {}
+        self.routing_table = {}
         self.config_check()
 
 
+def get_resolver_name(category: str, data: dict[str, Any]) -> str:
+    """Return the name of the path resolver for a category of the config."""
+    if "children" in data:
+        return "child"
+    elif "tags" in data:
+        return "category"
+    elif category == "Others":
+        return "filename"
+    return "simple"
+
+
 def safe_move(src: str | Path, dst: str | Path, logger: logging.Logger) -> None:
     """
     Safely moves a file or directory from the source to the destination.
@@ -271,7 +363,7 @@ def safe_move(src: str | Path, dst: str | Path, logger: logging.Logger) -> None:
                     logger.info(
                         f"Destination file already exists. It will be renamed to {dst_path}."
                     )
-            shutil.move(str(src_path), str(dst_path))
+            move_file(src_path, dst_path)
             logger.debug(f"Successfully move file to {dst_path}.")
         elif src_path.is_dir():
             if not dst_path.parent.exists():
@@ -291,12 +383,125 @@ def safe_move(src: str | Path, dst: str | Path, logger: logging.Logger) -> None:
         logger.error(f"Error occurred while moving '{src}' to '{dst}': {e}")
 
 
-def safe_rmtree(directory: Path) -> None:
-    """Delete folder if not .py file inside. Comes from deleting full project folder accidentally..."""
-    if not directory.exists():
-        return
-    if not any(file.suffix == ".py" or not is_system(file) for file in directory.glob("**/*")):
-        shutil.rmtree(directory)
+def move_file(src: str | Path, dst: str | Path, fsync: bool = False) -> None:
+    """
+    Move a file, a plain rename on the same device and a kernel-side copy across devices.
+
+    Device numbers are cached per folder, so the check costs one stat per folder instead of one
+    per file. Device pairs that refuse a rename are remembered and copied directly afterwards.
+
+    Args:
+        src (str | Path): The source file.
+        dst (str | Path): The destination file, its folder must exist.
+        fsync (bool, optional): Flush copied data to disk before removing the source.
+    """
+    src, dst = Path(src), Path(dst)
+    pair = (get_device(str(src.parent)), get_device(str(dst.parent)))
+    if pair[0] == pair[1] and pair not in CROSS_DEVICE_PAIRS:
+        try:
+            os.rename(src, dst)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            CROSS_DEVICE_PAIRS.add(pair)
+    copy_file(src, dst, fsync)
+    os.unlink(src)
+
+
+@functools.lru_cache(maxsize=4096)
+def get_device(directory: str) -> int:
+    return os.stat(directory).st_dev
+
+
+def copy_file(src: str | Path, dst: str | Path, fsync: bool = False) -> None:
+    """
+    Copy file data and metadata. On Linux the data is copied in the kernel when supported,
+    elsewhere shutil.copyfile picks the fast path of the platform.
+    """
+    try:
+        if USER_OS == "Linux":
+            with open(src, "rb", buffering=0) as fsrc, open(dst, "wb", buffering=0) as fdst:
+                size = os.fstat(fsrc.fileno()).st_size
+                _copy_data(fsrc.fileno(), fdst.fileno(), size)
+                if fsync:
+                    os.fsync(fdst.fileno())
+        else:
+            shutil.copyfile(src, dst)
+            if fsync:
+                with open(dst, "rb+") as fdst:
+                    os.fsync(fdst.fileno())
+        shutil.copystat(src, dst)
+    except BaseException:
+        Path(dst).unlink(missing_ok=True)
+        raise
+
+
+def reflink_file(src: str | Path, dst: str | Path) -> None:
+    """Clone a file copy-on-write, raise OSError where the filesystem or OS cannot."""
+    if USER_OS != "Linux":
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are only supported on Linux")
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+    except BaseException:
+        Path(dst).unlink(missing_ok=True)
+        raise
+
+
+def _copy_data(fd_in: int, fd_out: int, size: int) -> None:
+    copied = 0
+    fallback_errors = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF)
+    if hasattr(os, "copy_file_range"):
+        try:
+            while copied < size:
+                sent = os.copy_file_range(fd_in, fd_out, COPY_CHUNK)
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError as e:
+            if copied or e.errno not in fallback_errors:
+                raise
+    if copied == 0:
+        try:
+            while copied < size:
+                sent = os.sendfile(fd_out, fd_in, copied, COPY_CHUNK)
+                if sent == 0:
+                    break
+                copied += sent
+            os.lseek(fd_in, copied, os.SEEK_SET)
+        except OSError as e:
+            if copied or e.errno not in fallback_errors:
+                raise
+
+    # Userspace copy for the rest, e.g. when the file grew or the filesystem refuses both
+    while chunk := os.read(fd_in, COPY_BUFSIZE):
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(fd_out, view) :]
+
+
+def safe_rmtree(directory: Path, max_entries: int = RMTREE_CHECK_LIMIT) -> bool:
+    """
+    Delete folder if only system files are left inside. Comes from deleting full project folder
+    accidentally...
+
+    Only the top level is listed and any subfolder or other file keeps the folder, so the cost
+    depends on the leftover entries, not on the size of the original tree. Folders with more than
+    `max_entries` entries are kept without looking further. Returns True if the folder is removed.
+    """
+    try:
+        with os.scandir(directory) as entries:
+            for count, entry in enumerate(entries, 1):
+                if count > max_entries or entry.is_dir(follow_symlinks=False):
+                    return False
+                if not is_system(entry.name):
+                    return False
+    except OSError:
+        return False
+    shutil.rmtree(directory)
+    return True
 
 
 def generate_unique_path(path: Path) -> Path:
@@ -313,6 +518,23 @@ def generate_unique_path(path: Path) -> Path:
     return new_path
 
 
+def name_key(name: str) -> str:
+    """Key to compare file names with, names differing only in case clash on Windows and macOS."""
+    if CASE_INSENSITIVE_FS:
+        return unicodedata.normalize("NFC", name).casefold()
+    return name
+
+
+def unique_path(path: Path, taken: set[str]) -> Path:
+    """In-memory counterpart of generate_unique_path, checks name keys against `taken`."""
+    counter = 1
+    new_path = path.parent / f"{path.stem}-{counter}{path.suffix}"
+    while name_key(new_path.name) in taken:
+        counter += 1
+        new_path = path.parent / f"{path.stem}-{counter}{path.suffix}"
+    return new_path
+
+
 def traverse_dir(
     base_path: str | Path,
     recursive: bool = False,
@@ -353,19 +575,142 @@ def traverse_dir(
         >>> for file_path in traverse_folder(base_path, file_filter=is_txt_file, exclude_extensions=extensions):
         >>>     process_file(file_path)
     """
-    base_path = Path(base_path)
     if extensions:
         extensions = [f".{ext.lstrip('.')}" for ext in extensions]
 
-    search_method = base_path.rglob if recursive else base_path.glob
-
-    for file_path in search_method("*"):
-        if file_path.is_file() and file_filter(file_path):
-            if exclude_system_files and is_system(file_path.name):
+    pending = [Path(base_path)]
+    while pending:
+        for entry in scan_dir(pending.pop()):
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    pending.append(Path(entry.path))
                 continue
+            if not entry.is_file():
+                continue
+            if exclude_system_files and is_system(entry.name):
+                continue
+            file_path = Path(entry.path)
             if extensions and file_path.suffix not in extensions:
                 continue
-            yield file_path
+            if file_filter(file_path):
+                yield file_path
+
+
+def scan_dir(directory: str | Path) -> list[os.DirEntry]:
+    """List a directory with os.scandir, return an empty list if it cannot be read."""
+    try:
+        with os.scandir(directory) as entries:
+            return list(entries)
+    except OSError:
+        return []
+
+
+class DirectorySnapshot:
+    """
+    Directory listings shared by all path resolvers during a categorize pass.
+
+    Every directory is listed at most once with os.scandir. The DirEntry objects are kept, so
+    file types come from the listing and stat results are cached by the entry after the first
+    call. Whether a path exists is answered from the listing of its parent.
+    """
+
+    def __init__(self, watermark: Optional["ScanWatermark"] = None):
+        self.listings: dict[Path, dict[str, os.DirEntry]] = {}
+        self.watermark = watermark
+
+    def listing(self, directory: str | Path) -> dict[str, os.DirEntry]:
+        directory = Path(directory)
+        if directory not in self.listings:
+            self.listings[directory] = {entry.name: entry for entry in scan_dir(directory)}
+        return self.listings[directory]
+
+    def files(self, directory: str | Path, exclude_system_files: bool = True) -> Iterator[Path]:
+        """Yield the files of a directory, nothing if the watermark says it is unchanged."""
+        if self.watermark is not None and self.watermark.is_unchanged(directory):
+            return
+        file_count = 0
+        for entry in self.listing(directory).values():
+            if not entry.is_file():
+                continue
+            if exclude_system_files and is_system(entry.name):
+                continue
+            if is_partial(entry.name):
+                continue
+            file_count += 1
+            yield Path(entry.path)
+        if self.watermark is not None:
+            self.watermark.record_count(directory, file_count)
+
+    def get_entry(self, path: str | Path) -> Optional[os.DirEntry]:
+        path = Path(path)
+        return self.listing(path.parent).get(path.name)
+
+    def is_dir(self, path: str | Path) -> bool:
+        entry = self.get_entry(path)
+        return entry is not None and entry.is_dir()
+
+    def stat(self, path: str | Path) -> Optional[os.stat_result]:
+        entry = self.get_entry(path)
+        return entry.stat() if entry is not None else None
+
+    def invalidate(self, directory: str | Path) -> None:
+        self.listings.pop(Path(directory), None)
+
+
+class ScanWatermark:
+    """
+    Per-directory scan state persisted between runs.
+
+    A directory whose mtime and inode still match the recorded values has not gained or lost
+    entries since it was last listed, so listing it again can be skipped. The values are taken
+    before the directory is listed, a file that lands during the run changes the mtime and the
+    directory is scanned again next time.
+
+    Args:
+        state_path (str | Path): JSON file that stores the watermarks.
+        full_rescan (bool, optional): Ignore the stored state and scan everything, defaults to False.
+    """
+
+    def __init__(self, state_path: str | Path, full_rescan: bool = False):
+        self.state_path = Path(state_path)
+        self.state: dict[str, list[int]] = {} if full_rescan else self._load()
+        self.observed: dict[str, list[int]] = {}
+        self.skipped: list[str] = []
+
+    def is_unchanged(self, directory: str | Path) -> bool:
+        key = str(directory)
+        try:
+            stat = os.stat(directory)
+        except OSError:
+            return False
+        record = self.state.get(key, [])
+        unchanged = record[:2] == [stat.st_mtime_ns, stat.st_ino]
+        self.observed[key] = [stat.st_mtime_ns, stat.st_ino, record[2] if unchanged else 0]
+        if unchanged:
+            self.skipped.append(key)
+        return unchanged
+
+    def record_count(self, directory: str | Path, file_count: int) -> None:
+        if str(directory) in self.observed:
+            self.observed[str(directory)][2] = file_count
+
+    def discard(self, directory: str | Path) -> None:
+        """Forget a directory, it is listed again in the next run."""
+        self.observed.pop(str(directory), None)
+        self.state.pop(str(directory), None)
+
+    def save(self) -> None:
+        self.state.update(self.observed)
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.state_path, "w", encoding="utf-8") as file:
+            json.dump(self.state, file, ensure_ascii=False)
+
+    def _load(self) -> dict[str, list[int]]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
 
 
 def get_tagged_path(category_base: Path, file_tags: list[str], target_tags: dict[str, str]) -> Path:
@@ -377,19 +722,92 @@ def get_tagged_path(category_base: Path, file_tags: list[str], target_tags: dict
     return category_base / target_tags.get("others", "其他標籤")
 
 
-def count_files(paths: dict[str, dict[str, str]], logger, stats_dir: str = "remote_path") -> int:
-    file_count = 0
+class TagMatcher:
+    """
+    Resolve file names to tag folders with a precompiled alias table.
 
-    for _, path in paths.items():
-        path = Path(path[stats_dir])
-        if not path.is_dir():
-            logger.error(f"FileNotFoundError: '{path}' does not exist or not a directory.")
-        logger.debug(f"Counting number of files of '{path}'.")
+    Aliases come Unicode-normalized (NFKC) from the routing table and file tags are normalized
+    the same way, so strings that look the same but are encoded differently, e.g. the two forms
+    of ブルーアーカイブ, still match. Resolving a file costs one dict lookup per tag of the file,
+    independent of the number of aliases. The leading id field of the name is not a tag and is
+    never matched. Tags of files that fall back to the `others` folder are counted in
+    `unmatched`.
 
-        for _ in traverse_dir(path, recursive=True):
-            file_count += 1
+    Args:
+        target_tags (dict[str, str]): `CategoryRoute.tags`, normalized alias to folder name.
+        tag_delimiter (dict[str, str]): The `tag_delimiter` table of the config.
+    """
 
-    return file_count
+    def __init__(self, target_tags: dict[str, str], tag_delimiter: dict[str, str]):
+        self.aliases = target_tags
+        self.fallback = target_tags.get("others", "其他標籤")
+        self.tag_delimiter = tag_delimiter
+        self.unmatched: Counter[str] = Counter()
+
+    def match(self, file_name: str) -> tuple[str, str]:
+        """Return the folder name and the matched tag, the tag is empty for the fallback."""
+        file_tags = self._file_tags(Path(file_name).stem)
+        for tag in file_tags:
+            folder = self.aliases.get(normalize_tag(tag))
+            if folder is not None:
+                return folder, tag
+        self.unmatched.update(tag for tag in file_tags if tag)
+        return self.fallback, ""
+
+    def _file_tags(self, stem: str) -> list[str]:
+        """Split the tags of a file name, without the leading id field."""
+        file_tags = split_tags(stem, self.tag_delimiter)
+        front_delim = self.tag_delimiter.get("front", "")
+        first_field = stem.split(self.tag_delimiter.get("between", ","))[0]
+        if front_delim and front_delim in first_field:
+            # The first tag follows the id after the front delimiter
+            return file_tags
+        return file_tags[1:]
+
+
+def normalize_tag(tag: str) -> str:
+    return unicodedata.normalize("NFKC", tag).strip()
+
+
+def walk_tree(
+    roots: Iterable[str | Path], max_workers: int = SCAN_WORKERS, with_stat: bool = False
+) -> Iterator[tuple[os.DirEntry, Optional[os.stat_result]]]:
+    """
+    Yield every file below roots, skipping system files.
+
+    Directories are listed on a thread pool shared by all roots, so a slow network share is
+    read by several requests in flight instead of one directory after another. Set `with_stat`
+    to stat the files in the workers as well, the stat is None otherwise. A root listed more
+    than once is walked more than once.
+
+    Yields:
+        entry, stat: The DirEntry of a file and its stat result.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        pending: set[Future] = {
+            executor.submit(_scan_files, Path(root), with_stat) for root in roots
+        }
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                pending.update(executor.submit(_scan_files, d, with_stat) for d in subdirs)
+                yield from files
+
+
+def _scan_files(
+    directory: Path, with_stat: bool
+) -> tuple[list[tuple[os.DirEntry, Optional[os.stat_result]]], list[str]]:
+    files, subdirs = [], []
+    for entry in scan_dir(directory):
+        if entry.is_dir(follow_symlinks=False):
+            subdirs.append(entry.path)
+        elif entry.is_file() and not is_system(entry.name):
+            try:
+                files.append((entry, entry.stat() if with_stat else None))
+            except OSError:
+                continue
+    return files, subdirs
 
 
 class LogMerger:
@@ -444,6 +862,11 @@ def is_system(file_path: str | Path) -> bool:
     return Path(file_path).name in common_system_files
 
 
+def is_partial(file_path: str | Path) -> bool:
+    """Check if the file is an unfinished browser download."""
+    return str(file_path).lower().endswith(PARTIAL_EXT)
+
+
 def is_empty(file_path: str | Path) -> bool:
     # Check if any entry is a file that's not a system file or a directory that is not empty
     file_path = Path(file_path)
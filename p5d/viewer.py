@@ -1,6 +1,7 @@
 import logging
 import os
 from collections import Counter
+from typing import Optional
 
 import matplotlib
 
@@ -9,6 +10,7 @@ import matplotlib.pyplot as plt
 
 from p5d import app_settings, custom_logger
 from p5d.app_settings import STATS_FILE, FONT
+from p5d.catalog import ArtworkCatalog
 from p5d.utils import ConfigLoader, color_text, is_system, split_tags
 
 logging.getLogger("matplotlib").setLevel(logging.CRITICAL)
@@ -93,6 +95,13 @@ def count_tags(
     recursive: bool = True,
     output_file: str = "tags",
 ) -> None:
+    tag_counts, total_files = collect_tags(directory, tag_delimiter, recursive)
+    write_tag_counts(tag_counts, total_files, logger, output_file)
+
+
+def collect_tags(
+    directory: str, tag_delimiter: dict[str, str], recursive: bool = True
+) -> tuple[Counter, int]:
     all_tags = []
     total_files = 0
 
@@ -109,8 +118,12 @@ def count_tags(
                 tags = split_tags(filename, tag_delimiter)
                 all_tags.extend(tags)
                 total_files += 1
+    return Counter(all_tags), total_files
+
 
-    tag_counts = Counter(all_tags)
+def write_tag_counts(
+    tag_counts: Counter, total_files: int, logger: logging.Logger, output_file: str = "tags"
+) -> None:
     sorted_tags = sorted(tag_counts.items(), key=lambda x: x[1], reverse=True)
 
     with open(f"./{app_settings.OUTPUT_DIR}/{output_file}.txt", "w", encoding="utf-8") as f:
@@ -124,11 +137,19 @@ def count_tags(
 
 
 def viewer_main(
-    config_loader: ConfigLoader, logger: logging.Logger, stats_dir: str, file_name: str = STATS_FILE
+    config_loader: ConfigLoader,
+    logger: logging.Logger,
+    stats_dir: str,
+    file_name: str = STATS_FILE,
+    catalog: Optional[ArtworkCatalog] = None,
 ):
-    base_path = config_loader.get_base_paths()
-    tag_delimiter = config_loader.get_delimiters()
-    count_tags(base_path[stats_dir], tag_delimiter, logger, output_file=file_name)
+    if catalog is not None and catalog.is_built(stats_dir):
+        tag_counts, total_files = catalog.tag_counts(stats_dir)
+        write_tag_counts(tag_counts, total_files, logger, output_file=file_name)
+    else:
+        base_path = config_loader.get_base_paths()
+        tag_delimiter = config_loader.get_delimiters()
+        count_tags(base_path[stats_dir], tag_delimiter, logger, output_file=file_name)
     tag_counts = read_tag_counts(file_name)
     plot_pie_chart(tag_counts, logger, 15, skip=2)  # skip since the top tags are useless
 
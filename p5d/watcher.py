@@ -0,0 +1,241 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from p5d.app_settings import USER_OS, WATCH_INTERVAL, WATCH_MAX_DELAY, WATCH_SETTLE
+from p5d.utils import is_partial, scan_dir
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class PollingWatcher:
+    """
+    Detect changes of the download root by polling directory mtimes.
+
+    The root and its direct subfolders are checked, which is where Powerful Pixiv Downloader
+    saves new files. A finished download shows up as a new name, so the folder mtime changes.
+    """
+
+    def __init__(self, root: Path, interval: float = WATCH_INTERVAL):
+        self.root = root
+        self.interval = interval
+        self.signature = self._signature()
+
+    def wait(self, timeout: float) -> bool:
+        """Block up to `timeout` seconds, return True if anything changed."""
+        time.sleep(min(timeout, self.interval))
+        signature = self._signature()
+        changed = signature != self.signature
+        self.signature = signature
+        return changed
+
+    def reset(self) -> None:
+        """Forget changes seen so far, e.g. those made by a batch."""
+        self.signature = self._signature()
+
+    def close(self) -> None:
+        pass
+
+    def _signature(self) -> dict[str, int]:
+        signature = {}
+        for directory in [self.root] + watched_subdirs(self.root):
+            try:
+                signature[str(directory)] = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+        return signature
+
+
+class InotifyWatcher:
+    """
+    Detect changes of the download root with Linux inotify.
+
+    Watches the root and its direct subfolders, subfolders created later are added as they show
+    up. Raises OSError if inotify is not available.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches: dict[int, Path] = {}
+        for directory in [root] + watched_subdirs(root):
+            self._add_watch(directory)
+
+    def wait(self, timeout: float) -> bool:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        return self._read_events()
+
+    def reset(self) -> None:
+        """Drain queued events, e.g. those caused by a batch. New subfolders are still watched."""
+        while select.select([self.fd], [], [], 0)[0]:
+            if not self._read_events():
+                break
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+    def _read_events(self) -> bool:
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + name_len].rstrip(b"\0").decode(errors="surrogateescape")
+            offset += name_len
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped, subfolders created meanwhile may not be watched yet
+                for directory in watched_subdirs(self.root):
+                    if directory not in self.watches.values():
+                        self._add_watch(directory)
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and self.watches.get(wd):
+                if self.watches[wd] == self.root:
+                    self._add_watch(self.root / name)
+        return True
+
+    def _add_watch(self, directory: Path) -> None:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = directory
+
+
+def watched_subdirs(root: Path) -> list[Path]:
+    return [Path(entry.path) for entry in scan_dir(root) if entry.is_dir(follow_symlinks=False)]
+
+
+def file_signature(root: Path) -> dict[str, tuple[int, int]]:
+    """Size and mtime of the finished files in the root and its direct subfolders."""
+    signature = {}
+    for directory in [root] + watched_subdirs(root):
+        for entry in scan_dir(directory):
+            if is_partial(entry.name):
+                continue
+            try:
+                if entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    signature[entry.path] = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                continue
+    return signature
+
+
+def landed_during_batch(
+    before: dict[str, tuple[int, int]], after: dict[str, tuple[int, int]]
+) -> bool:
+    """
+    Check for files that are new or changed after a batch. A rename keeps size and mtime, so
+    files the batch moved within the watched folders are not counted.
+    """
+    moved = {value for path, value in before.items() if path not in after}
+    return any(before.get(path) != value and value not in moved for path, value in after.items())
+
+
+def create_watcher(root: Path, logger: logging.Logger) -> InotifyWatcher | PollingWatcher:
+    if USER_OS == "Linux":
+        try:
+            return InotifyWatcher(root)
+        except (OSError, AttributeError) as e:
+            logger.debug(f"inotify is not available, fall back to polling: {e}")
+    return PollingWatcher(root)
+
+
+def watch(
+    root: str | Path,
+    on_batch: Callable[[], None],
+    logger: logging.Logger,
+    settle: float = WATCH_SETTLE,
+    max_delay: float = WATCH_MAX_DELAY,
+    max_batches: Optional[int] = None,
+) -> None:
+    """
+    Run `on_batch` whenever new files have landed in `root`.
+
+    A batch starts after no change has been seen for `settle` seconds, or `max_delay` seconds
+    after the first pending change if downloads keep coming. Appending to a file does not touch
+    its folder, so the batch is also held back until no file changed size or mtime for `settle`
+    seconds. Files that land while a batch runs start the next one. Partial browser downloads
+    are never picked up by the path resolvers, they are handled once renamed to their final name.
+
+    Args:
+        root (str | Path): The download root, BASE_PATHS.local_path.
+        on_batch (Callable[[], None]): Categorize (and sync) the new files.
+        logger (logging.Logger): A logging instance to use for logging messages.
+        settle (float, optional): Quiet period before a batch starts, defaults to WATCH_SETTLE.
+        max_delay (float, optional): Longest wait for a pending change, defaults to WATCH_MAX_DELAY.
+        max_batches (int, optional): Stop after this many batches, runs forever if None.
+    """
+    root = Path(root)
+    watcher = create_watcher(root, logger)
+    logger.info(f"Watching '{root}' with {type(watcher).__name__}, press Ctrl-C to stop")
+    batches = 0
+    # Start with a pending change to pick up files that landed before watching
+    first_change = last_change = time.monotonic()
+    pending = True
+    files = file_signature(root)
+    try:
+        while max_batches is None or batches < max_batches:
+            now = time.monotonic()
+            if pending:
+                deadline = min(last_change + settle, first_change + max_delay)
+                timeout = max(0.0, deadline - now)
+            else:
+                timeout = WATCH_INTERVAL
+
+            if timeout > 0 and watcher.wait(timeout):
+                last_change = time.monotonic()
+                files = file_signature(root)
+                if not pending:
+                    first_change, pending = last_change, True
+                continue
+            if pending and time.monotonic() >= deadline:
+                current = file_signature(root)
+                if current != files:
+                    # Still being written
+                    files = current
+                    first_change = last_change = time.monotonic()
+                    continue
+                pending = False
+                batches += 1
+                logger.debug(f"Start batch {batches}")
+                try:
+                    on_batch()
+                except Exception as e:
+                    logger.error(f"Batch {batches} failed, keep watching: {e}")
+                # Events of the batch are drained, downloads that landed meanwhile are found by
+                # comparing with the signature taken before it
+                watcher.reset()
+                current = file_signature(root)
+                if landed_during_batch(files, current):
+                    first_change = last_change = time.monotonic()
+                    pending = True
+                files = current
+    except KeyboardInterrupt:
+        logger.info("Stop watching")
+    finally:
+        watcher.close()
@@ -1,9 +1,10 @@
 import platform
 import shutil
+import tempfile
 import unittest
 from pathlib import Path
 
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 from p5d.utils import ConfigLoader
 
 USER_OS = platform.system()
@@ -47,6 +48,15 @@ class TestBase(unittest.TestCase):
         self.config_loader.update_config(self.file_base)
         self.config_loader.update_config(self.categories_path)
 
+        # Scan state, manifest, mapping and logs of a run go to a temporary folder instead of
+        # the output folder of the repo
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.state_dir.cleanup)
+        for module in ("p5d.categorizer", "p5d.deduper", "p5d.synchronizer"):
+            patcher = patch(f"{module}.TEMP_DIR", self.state_dir.name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
     def tearDown(self):
         self.mock_logger.reset_mock()
 
@@ -0,0 +1,99 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from p5d.catalog import ArtworkCatalog
+from p5d.categorizer import categorize_files
+from p5d.viewer import collect_tags
+from tests.test_base import TestBase
+
+
+class TestArtworkCatalog(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.db_dir = tempfile.TemporaryDirectory()
+        self.catalog = ArtworkCatalog(self.config_loader, Path(self.db_dir.name) / "test.db")
+        self.combined_paths = self.config_loader.get_combined_paths()
+        Path(self.config_loader.get_base_paths()["local_path"]).mkdir(exist_ok=True)
+
+    def tearDown(self):
+        self.catalog.close()
+        self.db_dir.cleanup()
+        super().tearDownTestFile()
+
+    def test_count_files(self):
+        expected = 0
+        for i, category in enumerate(["Marin", "BlueArchive"]):
+            folder = Path(self.combined_paths[category]["local_path"]) / "sub" / "deeper"
+            folder.mkdir(parents=True, exist_ok=True)
+            for j in range(i + 2):
+                (folder / f"file{j}.jpg").write_text("test")
+                (folder.parent / f"file{j}.jpg").write_text("test")
+                expected += 2
+            (folder / ".DS_Store").write_text("")
+
+        # main() counts the stats folder this way, walking it once with walk_tree
+        self.catalog.rebuild("local_path")
+        self.assertEqual(self.catalog.count_files("local_path"), expected)
+
+    def test_open_on_first_use(self):
+        db_path = Path(self.db_dir.name) / "lazy" / "lazy.db"
+        catalog = ArtworkCatalog(self.config_loader, db_path)
+        self.assertFalse(db_path.exists())
+        self.assertFalse(catalog.is_built("local_path"))
+        catalog.close()
+        self.assertTrue(db_path.exists())
+
+    def test_rebuild(self):
+        cat_dir = Path(self.combined_paths["Marin"]["local_path"])
+        cat_dir.mkdir(parents=True, exist_ok=True)
+        (cat_dir / "12345_p0,tag1,tag2.jpg").write_text("test")
+        (cat_dir / "12345_p1,tag1.jpg").write_text("test")
+        (cat_dir / ".DS_Store").write_text("")
+
+        self.assertFalse(self.catalog.is_built("local_path"))
+        self.catalog.rebuild("local_path")
+
+        self.assertTrue(self.catalog.is_built("local_path"))
+        self.assertEqual(self.catalog.count_files("local_path"), 2)
+        tag_counts, total = self.catalog.tag_counts("local_path")
+        self.assertEqual(total, 2)
+        self.assertEqual(tag_counts["tag1"], 1)
+        self.assertEqual(tag_counts["tag1.jpg"], 1)
+        self.assertTrue(self.catalog.has_pixiv_id("12345"))
+        self.assertFalse(self.catalog.has_pixiv_id("12345", "remote_path"))
+        self.assertFalse(self.catalog.has_pixiv_id("54321"))
+
+    def test_tag_counts_match_viewer(self):
+        for category, names in [
+            ("Marin", ["12345_p0,tag1,tag2.jpg", "12345_p1,tag1.jpg"]),
+            ("BlueArchive", ["98765_p0,亞絲娜,tag1.png", "no_tags.jpg"]),
+        ]:
+            cat_dir = Path(self.combined_paths[category]["local_path"])
+            cat_dir.mkdir(parents=True, exist_ok=True)
+            for name in names:
+                (cat_dir / name).write_text("test")
+
+        self.catalog.rebuild("local_path")
+        base_path = self.config_loader.get_base_paths()["local_path"]
+        expected = collect_tags(base_path, self.config_loader.get_delimiters())
+        self.assertEqual(self.catalog.tag_counts("local_path"), expected)
+
+    def test_categorize_files_records_moves(self):
+        cat = "BlueArchive"
+        cat_dir = Path(self.combined_paths[cat]["local_path"])
+        cat_dir.mkdir(parents=True, exist_ok=True)
+        (cat_dir / "98765_p0,亞絲娜.jpg").write_text("test")
+
+        categorize_files(self.config_loader, False, self.mock_logger, catalog=self.catalog)
+
+        dst = cat_dir / "一之瀬アスナ" / "98765_p0,亞絲娜.jpg"
+        row = self.catalog.conn.execute(
+            "SELECT category, pixiv_id, page FROM files WHERE path = ?", (str(dst),)
+        ).fetchone()
+        self.assertEqual(row, (cat, "98765", 0))
+        self.assertEqual(self.catalog.count_files("local_path"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,10 @@
+import os
 import random
 import unittest
 from pathlib import Path
+from unittest.mock import patch
 
-from p5d.app_settings import EN, JP, OTHER
+from p5d.app_settings import EN, JP, MOVE_PLAN, OTHER, OUTPUT_DIR
 from p5d.utils import safe_move
 from p5d.categorizer import (
     FilenamePathResolver,
@@ -10,8 +12,13 @@ from p5d.categorizer import (
     ChildPathResolver,
     SimplePathResolver,
     ResolverAdapter,
+    apply_plan,
+    categorize_files,
+    read_mapping,
+    write_mapping,
 )
-from tests.test_base import TestBase
+from p5d.mover import MoveExecutor, read_plan
+from tests.test_base import TestBase, TEST_LOCAL
 
 
 class TestResolverAdapter(TestBase):
@@ -59,18 +66,19 @@ class TestResolverAdapter(TestBase):
             f"Processing '{category_simple}' with path resolver 'simple'"
         )
 
-    def test_resolver_queue_eviction(self):
+    def test_resolver_cache(self):
         self.adapter.resolver_cache.clear()
         categories = self.config_loader.get_categories()
         cat1 = "BlueArchive"  # resolver_name = "category"
         cat2 = "IdolMaster"  # resolver_name = "child"
         cat3 = "Others"  # resolver_name = "filename"
-        self.adapter.get_resolver(cat1, categories)
+        resolver = self.adapter.get_resolver(cat1, categories)
         self.adapter.get_resolver(cat2, categories)
         self.adapter.get_resolver(cat3, categories)
 
-        # pop resolver_name = "category"
-        self.assertNotIn("category", self.adapter.resolver_cache)
+        # Resolvers are kept when categories alternate between types
+        self.assertIs(self.adapter.get_resolver(cat1, categories), resolver)
+        self.assertEqual(set(self.adapter.resolver_cache), {"category", "child", "filename"})
 
 
 class TestFilenamePathResolver(TestBase):
@@ -206,5 +214,206 @@ class TestSimplePathResolver(TestBase):
         self.assertTrue((cat_dir / fn[2]).exists())
 
 
+class TestMoveExecutor(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.executor = MoveExecutor(self.mock_logger, max_workers=4)
+        self.src_dir = self.root_dir / TEST_LOCAL / "src"
+        self.dst_dir = self.root_dir / TEST_LOCAL / "dst" / "nested"
+        self.src_dir.mkdir(parents=True, exist_ok=True)
+
+    def tearDown(self):
+        super().tearDownTestFile()
+
+    def test_run_creates_dir_and_moves(self):
+        pairs = []
+        for i in range(10):
+            file_path = self.src_dir / f"file{i}.jpg"
+            file_path.write_text("test")
+            pairs.append((file_path, self.dst_dir / file_path.name))
+
+        self.assertEqual(self.executor.run(pairs), 10)
+        for src, dst in pairs:
+            self.assertFalse(src.exists())
+            self.assertTrue(dst.exists())
+
+    def test_run_resolves_collisions(self):
+        self.dst_dir.mkdir(parents=True, exist_ok=True)
+        (self.dst_dir / "dup.jpg").write_text("existing")
+        other_dir = self.src_dir / "other"
+        other_dir.mkdir()
+        pairs = []
+        for folder in (self.src_dir, other_dir):
+            file_path = folder / "dup.jpg"
+            file_path.write_text(str(folder))
+            pairs.append((file_path, self.dst_dir / "dup.jpg"))
+
+        self.assertEqual(self.executor.run(pairs), 2)
+        self.assertEqual((self.dst_dir / "dup.jpg").read_text(), "existing")
+        self.assertEqual((self.dst_dir / "dup-1.jpg").read_text(), str(self.src_dir))
+        self.assertEqual((self.dst_dir / "dup-2.jpg").read_text(), str(other_dir))
+
+    def test_run_resolves_case_collisions(self):
+        self.dst_dir.mkdir(parents=True, exist_ok=True)
+        (self.dst_dir / "dup.jpg").write_text("existing")
+        (self.src_dir / "DUP.JPG").write_text("new")
+        pairs = [(self.src_dir / "DUP.JPG", self.dst_dir / "DUP.JPG")]
+
+        with patch("p5d.utils.CASE_INSENSITIVE_FS", True):
+            self.assertEqual(self.executor.run(pairs), 1)
+        self.assertEqual((self.dst_dir / "dup.jpg").read_text(), "existing")
+        self.assertEqual((self.dst_dir / "DUP-1.JPG").read_text(), "new")
+
+    def test_run_resolves_collisions_in_memory(self):
+        self.dst_dir.mkdir(parents=True, exist_ok=True)
+        for i in ["", "-1", "-2"]:
+            (self.dst_dir / f"page{i}.jpg").write_text("existing")
+        pairs = []
+        for i in range(3):
+            folder = self.src_dir / str(i)
+            folder.mkdir()
+            (folder / "page.jpg").write_text(str(i))
+            pairs.append((folder / "page.jpg", self.dst_dir / "page.jpg"))
+
+        with patch.object(Path, "exists", side_effect=AssertionError("probed")):
+            self.assertEqual(self.executor.run(pairs), 3)
+        for i in range(3):
+            self.assertEqual((self.dst_dir / f"page-{i + 3}.jpg").read_text(), str(i))
+
+    def test_categorize_files_removes_drained_children(self):
+        cat = "IdolMaster"
+        cat_dir = Path(self.config_loader.get_combined_paths()[cat]["local_path"])
+        child_dir = cat_dir.parent / self.config_loader.get_categories()[cat]["children"][0]
+        child_dir.mkdir(parents=True, exist_ok=True)
+        (child_dir / "file1,黛冬優子,NoTag1.jpg").write_text("test")
+
+        self.assertEqual(categorize_files(self.config_loader, False, self.mock_logger), 1)
+
+        self.assertTrue((cat_dir / "黛冬優子" / "file1,黛冬優子,NoTag1.jpg").exists())
+        self.assertFalse(child_dir.exists())
+
+    def test_categorize_files_keeps_children_with_leftovers(self):
+        cat = "IdolMaster"
+        cat_dir = Path(self.config_loader.get_combined_paths()[cat]["local_path"])
+        child_dir = cat_dir.parent / self.config_loader.get_categories()[cat]["children"][0]
+        (child_dir / "nested").mkdir(parents=True, exist_ok=True)
+        (child_dir / "nested" / "keep.jpg").write_text("test")
+        (child_dir / "file1,黛冬優子,NoTag1.jpg").write_text("test")
+
+        with patch("p5d.categorizer.safe_rmtree") as mock_rmtree:
+            categorize_files(self.config_loader, False, self.mock_logger)
+
+        mock_rmtree.assert_not_called()
+        self.assertTrue((child_dir / "nested" / "keep.jpg").exists())
+
+
+class TestDirectorySnapshot(TestBase):
+    def tearDown(self):
+        super().tearDownTestFile()
+
+    def test_root_listed_once(self):
+        root = self.root_dir / TEST_LOCAL
+        cat_dir = Path(self.config_loader.get_combined_paths()["Others"]["local_path"])
+        cat_dir.mkdir(parents=True, exist_ok=True)
+        (root / "Never_loses,tag4,notag1,tag5.jpg").write_text("test")
+
+        with patch("p5d.utils.os.scandir", wraps=os.scandir) as mock_scandir:
+            categorize_files(self.config_loader, False, self.mock_logger)
+
+        listed = [Path(c.args[0]) for c in mock_scandir.call_args_list]
+        self.assertEqual(listed.count(root), 1)
+        self.assertTrue((cat_dir / EN / "Never_loses,tag4,notag1,tag5.jpg").exists())
+
+
+class TestScanWatermark(TestBase):
+    def tearDown(self):
+        super().tearDownTestFile()
+
+    def test_skip_unchanged_folder(self):
+        cat_dir = Path(self.config_loader.get_combined_paths()["Marin"]["local_path"])
+        cat_dir.mkdir(parents=True, exist_ok=True)
+        (cat_dir / "file1,NoTag1.jpg").write_text("test")
+        categorize_files(self.config_loader, False, self.mock_logger)
+
+        with patch("p5d.utils.os.scandir", wraps=os.scandir) as mock_scandir:
+            categorize_files(self.config_loader, False, self.mock_logger)
+        listed = [Path(c.args[0]) for c in mock_scandir.call_args_list]
+        self.assertNotIn(cat_dir, listed)
+
+        with patch("p5d.utils.os.scandir", wraps=os.scandir) as mock_scandir:
+            categorize_files(self.config_loader, False, self.mock_logger, full_rescan=True)
+        listed = [Path(c.args[0]) for c in mock_scandir.call_args_list]
+        self.assertIn(cat_dir, listed)
+
+    def test_failed_move_retried(self):
+        cat_dir = Path(self.config_loader.get_combined_paths()["BlueArchive"]["local_path"])
+        cat_dir.mkdir(parents=True, exist_ok=True)
+        (cat_dir / "file1,亞絲娜.jpg").write_text("test")
+        with patch.object(MoveExecutor, "_move", return_value=False):
+            self.assertEqual(categorize_files(self.config_loader, False, self.mock_logger), 0)
+
+        self.assertEqual(categorize_files(self.config_loader, False, self.mock_logger), 1)
+
+    def test_direct_sync_rescans(self):
+        cat_dir = Path(self.config_loader.get_combined_paths()["Marin"]["local_path"])
+        cat_dir.mkdir(parents=True, exist_ok=True)
+        (cat_dir / "file1,NoTag1.jpg").write_text("test")
+        self.assertEqual(categorize_files(self.config_loader, True, self.mock_logger), 1)
+        # Rerun after a failed sync, the file is still waiting to be sent
+        self.assertEqual(categorize_files(self.config_loader, True, self.mock_logger), 1)
+
+
+class TestMovePlan(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.plan_path = self.root_dir / OUTPUT_DIR / MOVE_PLAN
+
+    def tearDown(self):
+        super().tearDownTestFile()
+        self.plan_path.unlink(missing_ok=True)
+
+    def test_plan_and_apply(self):
+        cat_dir = Path(self.config_loader.get_combined_paths()["BlueArchive"]["local_path"])
+        (cat_dir / "一之瀬アスナ").mkdir(parents=True, exist_ok=True)
+        (cat_dir / "一之瀬アスナ" / "file1,亞絲娜.jpg").write_text("existing")
+        (cat_dir / "file1,亞絲娜.jpg").write_text("test")
+
+        categorize_files(self.config_loader, False, self.mock_logger, plan_only=True)
+        self.assertTrue((cat_dir / "file1,亞絲娜.jpg").exists())
+
+        plan, _ = read_plan(self.plan_path)
+        self.assertEqual(len(plan), 1)
+        self.assertEqual(plan[0].resolver, "category")
+        self.assertEqual(plan[0].tag, "亞絲娜")
+        self.assertEqual(plan[0].renamed_from, "file1,亞絲娜.jpg")
+        self.assertEqual(plan[0].dst, cat_dir / "一之瀬アスナ" / "file1,亞絲娜-1.jpg")
+
+        apply_plan(self.config_loader, self.mock_logger)
+        self.assertFalse((cat_dir / "file1,亞絲娜.jpg").exists())
+        self.assertEqual((cat_dir / "一之瀬アスナ" / "file1,亞絲娜-1.jpg").read_text(), "test")
+
+
+class TestMapping(TestBase):
+    def tearDown(self):
+        super().tearDownTestFile()
+
+    def test_write_read(self):
+        mapping_path = self.root_dir / TEST_LOCAL / "mapping.txt"
+        mapping_path.parent.mkdir(parents=True, exist_ok=True)
+        mapping = {
+            "/remote/調月リオ": ["/local/a,调月莉音.jpg", "/local/b,调月莉音.jpg"],
+            "/remote/早瀬ユウカ": ["/local/c,早瀬ユウカ.jpg"],
+        }
+        write_mapping(mapping, mapping_path)
+        groups = list(read_mapping(mapping_path))
+        self.assertEqual(
+            groups,
+            [
+                ("/remote/調月リオ", "/local/a,调月莉音.jpg\n/local/b,调月莉音.jpg\n"),
+                ("/remote/早瀬ユウカ", "/local/c,早瀬ユウカ.jpg\n"),
+            ],
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
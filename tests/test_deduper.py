@@ -0,0 +1,98 @@
+import os
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from p5d.categorizer import categorize_files
+from p5d.deduper import Deduplicator, HashCache
+from p5d.mover import MoveTask
+from tests.test_base import TEST_LOCAL, TestBase
+
+
+class TestDeduplicator(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.folder = self.root_dir / TEST_LOCAL / "dedup"
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.config_loader.config["custom"]["dedup"] = "skip"
+        self.deduper = Deduplicator(self.config_loader, self.mock_logger)
+        self.deduper.cache = HashCache(self.root_dir / TEST_LOCAL / "hash_cache.json")
+
+    def tearDown(self):
+        self.config_loader.config["custom"].pop("dedup", None)
+        super().tearDownTestFile()
+
+    def write(self, name: str, content: str) -> Path:
+        path = self.folder / name
+        path.write_text(content)
+        return path
+
+    def test_find(self):
+        a = self.write("a,tag1.jpg", "same content")
+        b = self.write("b,tag2.jpg", "same content")
+        c = self.write("c,tag3.jpg", "diff content")
+        self.write("d,tag4.jpg", "other")
+
+        duplicates = self.deduper.find(sorted(self.folder.iterdir()))
+        self.assertEqual(duplicates, {b: a})
+        self.assertNotIn(c, duplicates)
+
+    def test_find_cached(self):
+        paths = [self.write("a.jpg", "same"), self.write("b.jpg", "same")]
+        self.deduper.find(paths)
+
+        deduper = Deduplicator(self.config_loader, self.mock_logger)
+        deduper.cache = HashCache(self.deduper.cache.cache_path)
+        with patch("p5d.deduper.hash_file", side_effect=AssertionError("hashed")):
+            self.assertEqual(len(deduper.find(paths)), 1)
+
+    def test_filter_tasks_skip(self):
+        a = self.write("a.jpg", "same")
+        b = self.write("b.jpg", "same")
+        tasks = [MoveTask(a, self.folder / "x" / a.name), MoveTask(b, self.folder / "y" / b.name)]
+        kept, duplicates = self.deduper.filter_tasks(tasks)
+        self.assertEqual(kept, tasks[:1])
+        self.assertEqual(duplicates, {b: a})
+
+    def test_excludes(self):
+        other = self.root_dir / TEST_LOCAL / "other"
+        other.mkdir()
+        self.write("a.jpg", "same")
+        (other / "sub").mkdir()
+        (other / "sub" / "b.jpg").write_text("same")
+
+        excludes = self.deduper.excludes([self.folder, other])
+        self.assertEqual(excludes, {other: ["sub/b.jpg"]})
+
+    def test_link_moved_only(self):
+        self.deduper.mode = "link"
+        a = self.write("a.jpg", "same")
+        b = self.write("b.jpg", "same")
+        (self.folder / "x").mkdir()
+        (self.folder / "y").mkdir()
+        a_dst, b_dst = self.folder / "x" / a.name, self.folder / "y" / b.name
+        a.rename(a_dst)
+        # The move of b failed, the file at its destination is not a duplicate
+        b_dst.write_text("unrelated")
+
+        linked = self.deduper.link([MoveTask(a, a_dst)], {b: a})
+        self.assertEqual(linked, 0)
+        self.assertEqual(b_dst.read_text(), "unrelated")
+
+    def test_categorize_files_link(self):
+        self.config_loader.config["custom"]["dedup"] = "link"
+        cat = "BlueArchive"
+        cat_dir = Path(self.config_loader.get_combined_paths()[cat]["local_path"])
+        cat_dir.mkdir(parents=True, exist_ok=True)
+        (cat_dir / "file1,調月リオ.jpg").write_text("same")
+        (cat_dir / "file2,亞絲娜.jpg").write_text("same")
+
+        categorize_files(self.config_loader, False, self.mock_logger)
+
+        original = os.stat(cat_dir / "調月リオ" / "file1,調月リオ.jpg")
+        duplicate = os.stat(cat_dir / "一之瀬アスナ" / "file2,亞絲娜.jpg")
+        self.assertEqual(original.st_ino, duplicate.st_ino)
+
+
+if __name__ == "__main__":
+    unittest.main()
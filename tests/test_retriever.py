@@ -0,0 +1,344 @@
+import json
+import logging
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from p5d.retriever import (
+    LookupCache,
+    RateGovernor,
+    danbooru,
+    danbooru_batch,
+    fetch_all,
+    parse_retry_after,
+    read_checkpoint,
+    retrieve_artwork,
+    write_retrieve_results,
+)
+
+FOUND_PAGE = """<html><body><div id="posts">
+<article id="post_{0}1"></article><article id="post_{0}2"></article>
+</div></body></html>"""
+EMPTY_PAGE = '<html><body><div id="posts"><p>No posts found.</p></div></body></html>'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Danbooru search pages and posts JSON API. Ids starting with 1 have two posts, ids starting
+    with 3 have one banned post and the other ids have none.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.clients.add(self.client_address)
+        with self.server.lock:
+            throttled = self.server.throttle > 0
+            self.server.throttle -= 1
+        if throttled:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.server.paths.append(self.path)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        pixiv_id = query["tags"][0].split(":")[1]
+        if url.path == "/posts.json":
+            body, content_type = self.posts_json(pixiv_id.split(","), query), "application/json"
+        else:
+            page = FOUND_PAGE.format(pixiv_id) if pixiv_id.startswith("1") else EMPTY_PAGE
+            body, content_type = page.encode(), "text/html"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def posts_json(self, pixiv_ids: list[str], query: dict[str, list[str]]) -> bytes:
+        posts = []
+        for pixiv_id in pixiv_ids:
+            if pixiv_id.startswith("1"):
+                posts += [{"id": int(f"{pixiv_id}{n}"), "pixiv_id": int(pixiv_id)} for n in (1, 2)]
+            elif pixiv_id.startswith("3"):
+                posts.append(
+                    {"id": int(f"{pixiv_id}1"), "pixiv_id": int(pixiv_id), "is_banned": True}
+                )
+        limit, page = int(query["limit"][0]), int(query["page"][0])
+        return json.dumps(posts[(page - 1) * limit : page * limit]).encode()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestRetriever(unittest.TestCase):
+    def setUp(self):
+        self.mock_logger = MagicMock()
+        self.mock_logger.getEffectiveLevel.return_value = logging.DEBUG
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.clients = set()
+        self.server.paths = []
+        self.server.lock = threading.Lock()
+        self.server.throttle = 0
+        self.governor = RateGovernor(rate=1000, max_rate=1000)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.patchers = [
+            patch("p5d.retriever.DANBOORU_SEARCH_URL", f"{base_url}/posts?tags=pixiv%3A{{}}&z=5"),
+            patch("p5d.retriever.DANBOORU_API_URL", f"{base_url}/posts.json"),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_fetch_all(self):
+        pixiv_ids = [str(i) for i in range(100, 120)] + [str(i) for i in range(200, 220)]
+        results = fetch_all(pixiv_ids, danbooru, self.mock_logger, 4, self.governor)
+
+        self.assertEqual(len(results), 40)
+        self.assertEqual(results["100"], ["1001", "1002"])
+        self.assertEqual(results["200"], "No posts found.")
+        # Kept alive, at most one connection per worker
+        self.assertLessEqual(len(self.server.clients), 4)
+
+    def test_fetch_all_streams(self):
+        taken, finished = [0], [0]
+
+        def pixiv_ids():
+            for i in range(100, 120):
+                taken[0] += 1
+                yield str(i)
+
+        def on_result(data):
+            finished[0] += 1
+            # Never more than two lookups per worker ahead of the finished ones
+            self.assertLessEqual(taken[0] - finished[0], 4)
+
+        results = fetch_all(
+            pixiv_ids(), danbooru, self.mock_logger, 2, self.governor, on_result=on_result
+        )
+        self.assertEqual(results, {})
+        self.assertEqual(finished[0], 20)
+
+    def test_fetch_all_exception(self):
+        def broken(pixiv_id, logger, **kwargs):
+            raise ValueError("broken")
+
+        self.assertEqual(
+            fetch_all(["1"], broken, self.mock_logger, governor=self.governor),
+            {"1": "Lookup failed: broken"},
+        )
+        self.mock_logger.error.assert_called_once()
+
+    def test_fetch_all_rate_limited(self):
+        self.server.throttle = 3
+        results = fetch_all(["100", "101"], danbooru, self.mock_logger, 2, self.governor)
+
+        self.assertEqual(results["100"], ["1001", "1002"])
+        self.assertEqual(results["101"], ["1011", "1012"])
+        self.mock_logger.error.assert_not_called()
+        self.assertLess(self.governor.rate, 1000)
+
+    def test_fetch_all_batched(self):
+        pixiv_ids = ["100", "101", "200", "300", "301"]
+        with patch("p5d.retriever.DANBOORU_API_LIMIT", 2):
+            results = fetch_all(
+                pixiv_ids, danbooru_batch, self.mock_logger, governor=self.governor, batch_size=3
+            )
+
+        self.assertEqual(results["100"], ["1001", "1002"])
+        self.assertEqual(results["101"], ["1011", "1012"])
+        self.assertEqual(results["200"], "No posts found.")
+        self.assertEqual(results["300"], "Hidden posts")
+        self.assertEqual(results["301"], "Hidden posts")
+        # Two full pages and an empty one, then a full page and an empty one
+        self.assertEqual(len(self.server.paths), 5)
+        self.assertTrue(all("only=id%2Cpixiv_id%2Cis_banned" in path for path in self.server.paths))
+
+    def test_batch_error(self):
+        self.server.throttle = 10
+        results = danbooru_batch(["100", "200"], self.mock_logger, retry=2, governor=self.governor)
+        self.assertEqual(
+            results,
+            {
+                "100": "HTTPS connection error with code 429",
+                "200": "HTTPS connection error with code 429",
+            },
+        )
+
+    def test_retrieve_resume(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        retrieve_dir = Path(temp_dir.name)
+        (retrieve_dir / "id.txt").write_text(
+            "".join(f"{pixiv_id} 404 not found\n" for pixiv_id in ["100", "140", "200", "100"])
+        )
+        # Interrupted run, the second line was cut off
+        checkpoint_path = retrieve_dir / "id_checkpoint.jsonl"
+        checkpoint_path.write_text('{"pixiv_id": "200", "result": "Hidden posts"}\n{"pixiv_id')
+
+        with (
+            patch("p5d.retriever.RETRIEVE_DIR", str(retrieve_dir)),
+            patch("p5d.retriever.TEMP_DIR", str(retrieve_dir / "temp")),
+            patch("p5d.retriever.RETRIEVE_CHUNK", 2),
+            patch("p5d.retriever.RateGovernor", return_value=self.governor),
+        ):
+            retrieve_artwork(self.mock_logger)
+
+        self.assertEqual(len(self.server.paths), 2)
+        self.assertFalse(checkpoint_path.exists())
+        lines = (retrieve_dir / "id_retrieve.txt").read_text().splitlines()
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(lines[-1], "# 200 Hidden posts")
+        self.assertIn("# 140", lines)
+        self.assertIn("https://danbooru.donmai.us/posts/1401", lines)
+
+    def test_retrieve_errors_retried(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        retrieve_dir = Path(temp_dir.name)
+        (retrieve_dir / "id.txt").write_text("100 404 not found\n200 404 not found\n")
+        checkpoint_path = retrieve_dir / "id_checkpoint.jsonl"
+        output_path = retrieve_dir / "id_retrieve.txt"
+
+        def flaky(pixiv_id, logger, **kwargs):
+            if pixiv_id == "200":
+                raise requests.ConnectionError("reset")
+            return danbooru(pixiv_id, logger, **kwargs)
+
+        with (
+            patch("p5d.retriever.RETRIEVE_DIR", str(retrieve_dir)),
+            patch("p5d.retriever.TEMP_DIR", str(retrieve_dir / "temp")),
+            patch("p5d.retriever.RateGovernor", return_value=self.governor),
+        ):
+            with patch("p5d.retriever.danbooru", flaky):
+                retrieve_artwork(self.mock_logger)
+            self.assertIn("# 200 retrieve error: Lookup failed: reset", output_path.read_text())
+            self.assertEqual(
+                [pixiv_id for pixiv_id, _ in read_checkpoint(checkpoint_path)], ["100"]
+            )
+
+            retrieve_artwork(self.mock_logger)
+
+        self.assertFalse(checkpoint_path.exists())
+        self.assertIn("# 200 No posts found", output_path.read_text())
+        # 100 came from the checkpoint, only 200 was looked up again
+        self.assertEqual(len(self.server.paths), 2)
+
+    def test_retry_exhausted(self):
+        self.server.throttle = 10
+        results = fetch_all(["100"], danbooru, self.mock_logger, 1, self.governor)
+
+        self.assertEqual(results["100"], "HTTPS connection error with code 429")
+        self.mock_logger.error.assert_called_once()
+
+
+class TestRateGovernor(unittest.TestCase):
+    def test_throttle(self):
+        governor = RateGovernor(rate=8, max_rate=10, step=1)
+        delay = governor.throttle(2)
+        self.assertGreaterEqual(delay, 2)
+        self.assertEqual(governor.rate, 4)
+        # Throttled again during the same pause
+        governor.throttle(1)
+        self.assertEqual(governor.rate, 4)
+        self.assertGreaterEqual(governor.paused_until - time.monotonic(), 1.5)
+
+        governor.success()
+        self.assertEqual(governor.rate, 5)
+
+    def test_retry_after_date(self):
+        response = requests.Response()
+        response.headers["Retry-After"] = "Wed, 21 Oct 2015 07:28:00 GMT"
+        self.assertEqual(parse_retry_after(response), 0)
+        response.headers["Retry-After"] = "Wed, 21 Oct 2015 07:28:00 -0000"
+        self.assertEqual(parse_retry_after(response), 0)
+        future = datetime.now(timezone.utc) + timedelta(seconds=60)
+        response.headers["Retry-After"] = future.strftime("%a, %d %b %Y %H:%M:%S -0000")
+        self.assertGreater(parse_retry_after(response), 30)
+        response.headers["Retry-After"] = "3"
+        self.assertEqual(parse_retry_after(response), 3)
+        response.headers["Retry-After"] = "soon"
+        self.assertIsNone(parse_retry_after(response))
+
+
+class TestLookupCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_path = Path(self.temp_dir.name) / "retrieve_cache.json"
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_ttl(self):
+        cache = LookupCache(self.cache_path, positive_ttl=100, negative_ttl=10)
+        cache.put_many(
+            {
+                "1": ["11", "12"],
+                "2": "No posts found.",
+                "3": "Hidden posts",
+                "4": "HTTPS connection error with code 500",
+            }
+        )
+        cache.save()
+
+        cache = LookupCache(self.cache_path, positive_ttl=100, negative_ttl=10)
+        ids = ["1", "2", "3", "4", "5"]
+        self.assertEqual(
+            cache.get_many(ids), {"1": ["11", "12"], "2": "No posts found.", "3": "Hidden posts"}
+        )
+        with patch("p5d.retriever.time.time", return_value=time.time() + 50):
+            self.assertEqual(cache.get_many(ids), {"1": ["11", "12"]})
+        with patch("p5d.retriever.time.time", return_value=time.time() + 200):
+            self.assertEqual(cache.get_many(ids), {})
+
+    def test_save_prunes_expired(self):
+        cache = LookupCache(self.cache_path, positive_ttl=100, negative_ttl=10)
+        cache.put_many({"1": ["11"], "2": "No posts found."})
+        cache.save()
+
+        cache = LookupCache(self.cache_path, positive_ttl=100, negative_ttl=10)
+        with patch("p5d.retriever.time.time", return_value=time.time() + 50):
+            cache.save()
+        self.assertEqual(list(json.loads(self.cache_path.read_text())), ["1"])
+
+
+class TestWriteRetrieveResults(unittest.TestCase):
+    def test_sections(self):
+        results = [
+            ("1", "HTTPS connection error with code 500"),
+            ("2", "Hidden posts"),
+            ("3", "No posts found."),
+            ("4", ["41"]),
+        ]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = Path(temp_dir) / "id_retrieve.txt"
+            write_retrieve_results(iter(results), output_path)
+            self.assertEqual(
+                output_path.read_text().splitlines(),
+                [
+                    "# 4",
+                    "https://danbooru.donmai.us/posts/41",
+                    "# 3 No posts found",
+                    "# 2 Hidden posts",
+                    "# 1 retrieve error: HTTPS connection error with code 500",
+                ],
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,19 @@
+import json
 import random
+import tempfile
+import threading
+import time
 import unittest
 from pathlib import Path
+from unittest.mock import MagicMock, patch
 
-from p5d.app_settings import EN, JP, OTHER
+from p5d.app_settings import EN, JP, MAPPING_FILE, MAPPING_INDEX, OTHER, STAGE_DIR
+from p5d.catalog import ArtworkCatalog
 from p5d.categorizer import categorize_files
-from p5d.synchronizer import FileSyncer
-from tests.test_base import TestBase, safe_rmtree, TEST_REMOTE
+from p5d.manifest import RemoteManifest
+from p5d.synchronizer import DirectSyncStrategy, FileSyncer, NativeSyncStrategy, SyncError
+from p5d.utils import copy_file
+from tests.test_base import TestBase, safe_rmtree, TEST_LOCAL, TEST_REMOTE
 
 
 class TestFilenamePathResolver(TestBase):
@@ -99,5 +107,340 @@ class TestFilenamePathResolver(TestBase):
         self.assertTrue((cat4_remote / fn4[2]).exists())
 
 
+class TestFileSyncer(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.src = self.root_dir / TEST_LOCAL / "sync_src"
+        self.dst = self.root_dir / TEST_REMOTE / "sync_dst"
+        for name in ["a", "b", "c"]:
+            (self.src / name).mkdir(parents=True, exist_ok=True)
+            (self.src / name / f"{name}.jpg").write_text("test")
+        (self.src / "top.jpg").write_text("test")
+        self.stats_path = self.root_dir / TEST_LOCAL / "sync_stats.jsonl"
+
+    def tearDown(self):
+        for key in ["sync_split", "sync_jobs", "sync_jobs_per_device"]:
+            self.config_loader.config["custom"].pop(key, None)
+        super().tearDownTestFile()
+        safe_rmtree(self.root_dir / TEST_REMOTE)
+
+    def make_syncer(self) -> FileSyncer:
+        syncer = FileSyncer(self.config_loader, self.mock_logger)
+        syncer.stats_path = self.stats_path
+        return syncer
+
+    def test_split_jobs(self):
+        self.config_loader.config["custom"]["sync_split"] = 3
+        syncer = self.make_syncer()
+        jobs = syncer.make_jobs(self.src, self.dst)
+        self.assertEqual(
+            sorted((job.src, job.dst) for job in jobs),
+            [(self.src, self.dst)] + [(self.src / n, self.dst / n) for n in ["a", "b", "c"]],
+        )
+        top_job = next(job for job in jobs if job.src == self.src)
+        self.assertIn("/*/", top_job.exclude_path.read_text().splitlines())
+        self.assertEqual(len({job.log_path for job in jobs}), 4)
+
+    def test_no_split(self):
+        syncer = self.make_syncer()
+        jobs = syncer.make_jobs(self.src, self.dst)
+        self.assertEqual([(job.src, job.exclude_path) for job in jobs], [(self.src, None)])
+        with self.assertRaises(SyncError):
+            syncer.make_jobs(self.src / "missing", self.dst)
+
+    def test_run_jobs_concurrency(self):
+        self.config_loader.config["custom"]["sync_split"] = 3
+        self.config_loader.config["custom"]["sync_jobs_per_device"] = 2
+        syncer = self.make_syncer()
+        running, peak, lock = [0], [0], threading.Lock()
+
+        def fake_run(*args, **kwargs):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+
+        with patch("p5d.synchronizer.subprocess.run", side_effect=fake_run) as mock_run:
+            failed = syncer.run_jobs(syncer.make_jobs(self.src, self.dst))
+
+        self.assertEqual(failed, 0)
+        self.assertEqual(mock_run.call_count, 4)
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(list(Path(self.state_dir.name).glob("*.exclude")), [])
+
+    def test_busy_device_does_not_block_others(self):
+        self.config_loader.config["custom"]["sync_jobs"] = 2
+        self.config_loader.config["custom"]["sync_jobs_per_device"] = 1
+        syncer = self.make_syncer()
+        other_dst = self.root_dir / TEST_REMOTE / "other_dst"
+        jobs = syncer.make_jobs(self.src / "a", self.dst / "a", "A")
+        jobs += syncer.make_jobs(self.src / "b", self.dst / "b", "B")
+        jobs += syncer.make_jobs(self.src / "c", other_dst, "C")
+        started = {}
+
+        def fake_run(cmd, **kwargs):
+            started[cmd[-1]] = time.monotonic()
+            time.sleep(0.1)
+
+        devices = {str(self.dst / "a"): 1, str(self.dst / "b"): 1, str(other_dst): 2}
+        with (
+            patch("p5d.synchronizer.subprocess.run", side_effect=fake_run),
+            patch.object(FileSyncer, "_device_of", lambda _, dst: devices[str(dst)]),
+        ):
+            syncer.run_jobs(jobs)
+
+        # Two pool workers, the second job of device 1 must not hold one while device 2 waits
+        first = min(started.values())
+        self.assertLess(started[str(other_dst)] - first, 0.05)
+        self.assertEqual(len(started), 3)
+
+    def test_log_names_per_category(self):
+        syncer = self.make_syncer()
+        other_src = self.root_dir / TEST_LOCAL / "other" / "sync_src"
+        other_src.mkdir(parents=True)
+        jobs = syncer.make_jobs(self.src, self.dst, "A") + syncer.make_jobs(
+            other_src, self.dst, "B"
+        )
+        self.assertEqual(len({job.log_path for job in jobs}), 2)
+
+    def test_files_from_new_files(self):
+        self.dst.mkdir(parents=True, exist_ok=True)
+        (self.dst / "top.jpg").write_text("test")
+        syncer = self.make_syncer()
+        sent = []
+
+        def fake_run(cmd, **kwargs):
+            files_from = next(arg for arg in cmd if arg.startswith("--files-from="))
+            sent.extend(Path(files_from.split("=", 1)[1]).read_text().splitlines())
+
+        with patch("p5d.synchronizer.subprocess.run", side_effect=fake_run):
+            syncer.run_jobs(syncer.make_jobs(self.src, self.dst))
+        self.assertEqual(sorted(sent), ["a/a.jpg", "b/b.jpg", "c/c.jpg"])
+
+        for name in ["a", "b", "c"]:
+            (self.dst / name).mkdir()
+            (self.dst / name / f"{name}.jpg").write_text("test")
+        with patch("p5d.synchronizer.subprocess.run") as mock_run:
+            syncer.run_jobs(syncer.make_jobs(self.src, self.dst))
+        mock_run.assert_not_called()
+
+    def test_catalog_records_sent_files(self):
+        with tempfile.TemporaryDirectory() as db_dir:
+            catalog = ArtworkCatalog(self.config_loader, Path(db_dir) / "test.db")
+            syncer = FileSyncer(self.config_loader, self.mock_logger, catalog=catalog)
+            syncer.stats_path = self.stats_path
+
+            def fake_run(cmd, **kwargs):
+                log_file = next(arg for arg in cmd if arg.startswith("--log-file="))
+                (self.dst / "a").mkdir(parents=True, exist_ok=True)
+                (self.dst / "a" / "a.jpg").write_text("test")
+                with open(log_file.split("=", 1)[1], "a", encoding="utf-8") as file:
+                    file.write("2024/01/01 00:00:00 [1] >f+++++++++ 4 a/a.jpg\n")
+
+            with patch("p5d.synchronizer.subprocess.run", side_effect=fake_run):
+                syncer.run_jobs(syncer.make_jobs(self.src, self.dst))
+
+            paths = [row[0] for row in catalog.conn.execute("SELECT path FROM files")]
+            catalog.close()
+        # Only what rsync logged, not every local file
+        self.assertEqual(paths, [str(self.dst / "a" / "a.jpg")])
+
+    def test_stats(self):
+        self.config_loader.config["custom"]["sync_split"] = 3
+        syncer = self.make_syncer()
+
+        def fake_run(cmd, **kwargs):
+            log_file = next(arg for arg in cmd if arg.startswith("--log-file="))
+            with open(log_file.split("=", 1)[1], "a", encoding="utf-8") as file:
+                file.write("2024/01/01 00:00:00 [1] cd+++++++++ 0 a/\n")
+                file.write("2024/01/01 00:00:00 [1] >f+++++++++ 1,500 a/a.jpg\n")
+                file.write("2024/01/01 00:00:00 [1] sent 1,700 bytes  received 35 bytes\n")
+
+        with patch("p5d.synchronizer.subprocess.run", side_effect=fake_run):
+            syncer.run_jobs(syncer.make_jobs(self.src, self.dst, "Marin"))
+
+        records = [json.loads(line) for line in self.stats_path.read_text().splitlines()]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["category"], "Marin")
+        self.assertEqual(records[0]["jobs"], 4)
+        self.assertEqual(records[0]["files"], 4)
+        self.assertEqual(records[0]["bytes"], 6000)
+        self.assertGreaterEqual(records[0]["mb_per_s"], 0)
+
+
+class TestDirectSyncStrategy(TestBase):
+    def tearDown(self):
+        super().tearDownTestFile()
+        safe_rmtree(self.root_dir / TEST_REMOTE)
+
+    def prepare(self) -> Path:
+        cat = "BlueArchive"
+        cat_dir = Path(self.config_loader.get_combined_paths()[cat]["local_path"])
+        cat_dir.mkdir(parents=True, exist_ok=True)
+        (cat_dir / "file1,亞絲娜.jpg").write_text("test")
+        (cat_dir / "file2,调月莉音.jpg").write_text("test")
+        categorize_files(self.config_loader, True, self.mock_logger)
+        return Path(self.config_loader.get_base_paths()["local_path"]) / STAGE_DIR
+
+    def test_single_transfer(self):
+        stage_dir = self.prepare()
+        staged = []
+
+        def fake_run(cmd, **kwargs):
+            staged.extend(p.relative_to(stage_dir) for p in stage_dir.rglob("*.jpg"))
+
+        syncer = FileSyncer(self.config_loader, self.mock_logger, direct_sync=True)
+        with patch("p5d.synchronizer.subprocess.run", side_effect=fake_run) as mock_run:
+            syncer.sync_folders(None, None)
+
+        self.assertEqual(mock_run.call_count, 1)
+        remote = Path(self.config_loader.get_combined_paths()["BlueArchive"]["remote_path"])
+        remote = remote.relative_to(self.config_loader.get_base_paths()["remote_path"])
+        self.assertEqual(
+            sorted(staged),
+            [
+                remote / "一之瀬アスナ" / "file1,亞絲娜.jpg",
+                remote / "調月リオ" / "file2,调月莉音.jpg",
+            ],
+        )
+        # Only the files are listed, remote folders keep their times and permissions
+        self.assertIn("--no-implied-dirs", mock_run.call_args.args[0])
+        self.assertEqual(
+            sorted(mock_run.call_args.kwargs["input"].splitlines()),
+            [path.as_posix() for path in sorted(staged)],
+        )
+        self.assertFalse(stage_dir.exists())
+        temp_dir = Path(self.state_dir.name)
+        self.assertFalse((temp_dir / MAPPING_FILE).exists())
+        self.assertFalse((temp_dir / MAPPING_INDEX).exists())
+
+    def test_fallback_per_destination(self):
+        self.prepare()
+        syncer = FileSyncer(self.config_loader, self.mock_logger, direct_sync=True)
+        with (
+            patch("p5d.synchronizer.os.link", side_effect=OSError("not supported")),
+            patch("p5d.synchronizer.subprocess.run") as mock_run,
+        ):
+            syncer.sync_folders(None, None)
+
+        self.assertEqual(mock_run.call_count, 2)
+        for call_args in mock_run.call_args_list:
+            self.assertIn("--files-from=-", call_args.args[0])
+            self.assertEqual(len(call_args.kwargs["input"].splitlines()), 1)
+
+    def test_skipped_name_not_recorded(self):
+        local = Path(self.config_loader.get_base_paths()["local_path"])
+        remote_base = Path(self.config_loader.get_base_paths()["remote_path"])
+        for folder in ("a", "b"):
+            (local / folder).mkdir(parents=True, exist_ok=True)
+            (local / folder / "same.jpg").write_text(folder)
+        files_from = f"{local / 'a' / 'same.jpg'}\n{local / 'b' / 'same.jpg'}\n"
+        catalog = MagicMock()
+        strategy = DirectSyncStrategy([], self.config_loader, catalog)
+        with patch("p5d.synchronizer.subprocess.run"):
+            strategy._sync_staged(
+                [(str(remote_base / "dst"), files_from)], remote_base, local / STAGE_DIR
+            )
+
+        copies = catalog.record_copies.call_args.args[0]
+        self.assertEqual([path for path, _ in copies], [remote_base / "dst" / "same.jpg"])
+        self.assertEqual(copies[0][1].st_size, 1)
+
+
+class TestNativeSyncStrategy(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.src = self.root_dir / TEST_LOCAL / "native"
+        self.dst = self.root_dir / TEST_REMOTE / "native"
+        (self.src / "sub").mkdir(parents=True, exist_ok=True)
+        self.dst.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.root_dir / TEST_LOCAL / "manifest.json"
+        self.log_path = self.root_dir / TEST_LOCAL / "native.log"
+        self.strategy = NativeSyncStrategy(RemoteManifest(self.manifest_path))
+
+    def tearDown(self):
+        super().tearDownTestFile()
+        safe_rmtree(self.root_dir / TEST_REMOTE)
+
+    def test_copy_new_files(self):
+        (self.src / "a.jpg").write_text("new a")
+        (self.src / "sub" / "b.jpg").write_text("new b")
+        (self.dst / "a.jpg").write_text("remote a")
+
+        self.strategy.sync(self.src, self.dst, self.log_path)
+
+        self.assertEqual((self.dst / "a.jpg").read_text(), "remote a")
+        self.assertEqual((self.dst / "sub" / "b.jpg").read_text(), "new b")
+        self.assertEqual(list(self.dst.rglob(".*.p5d")), [])
+        self.assertIn(">f+++++++++ 5 sub/b.jpg", self.log_path.read_text())
+        self.assertNotIn(" a.jpg", self.log_path.read_text())
+
+    def test_no_overwrite_on_publish(self):
+        (self.src / "a.jpg").write_text("new a")
+        original_copy = copy_file
+
+        def copy_then_land(src, dst, fsync=False):
+            original_copy(src, dst, fsync)
+            # Written on the remote after the manifest scan
+            dst.with_name("a.jpg").write_text("landed")
+
+        with patch("p5d.synchronizer.copy_file", side_effect=copy_then_land):
+            self.strategy.sync(self.src, self.dst, self.log_path)
+
+        self.assertEqual((self.dst / "a.jpg").read_text(), "landed")
+        self.assertEqual(list(self.dst.rglob(".*.p5d")), [])
+        self.assertNotIn(" a.jpg", self.log_path.read_text())
+
+    def test_excludes(self):
+        (self.src / "a.jpg").write_text("a")
+        (self.src / "[b].jpg").write_text("b")
+        (self.src / "sub" / "c.jpg").write_text("c")
+        exclude_path = self.root_dir / TEST_LOCAL / "exclude.txt"
+        exclude_path.write_text("/\\[b].jpg\n/*/\n")
+
+        self.strategy.sync(self.src, self.dst, self.log_path, exclude_path)
+
+        self.assertEqual([p.name for p in self.dst.rglob("*.jpg")], ["a.jpg"])
+
+    def test_manifest_skips_unchanged_folders(self):
+        (self.src / "sub" / "b.jpg").write_text("b")
+        self.strategy.sync(self.src, self.dst, self.log_path)
+        self.strategy.manifest.save()
+
+        manifest = RemoteManifest(self.manifest_path)
+        with patch.object(RemoteManifest, "_list", side_effect=AssertionError("listed")):
+            self.assertEqual(list(manifest.scan(self.dst)), ["sub/b.jpg"])
+
+        (self.dst / "sub" / "c.jpg").write_text("c")
+        self.assertEqual(sorted(manifest.scan(self.dst)), ["sub/b.jpg", "sub/c.jpg"])
+
+    def test_hard_link(self):
+        (self.src / "sub" / "b.jpg").write_text("b")
+        strategy = NativeSyncStrategy(RemoteManifest(self.manifest_path), link="hard")
+        strategy.sync(self.src, self.dst, self.log_path)
+        self.assertTrue((self.dst / "sub" / "b.jpg").samefile(self.src / "sub" / "b.jpg"))
+
+    def test_link_fallback_copy(self):
+        (self.src / "sub" / "b.jpg").write_text("b")
+        strategy = NativeSyncStrategy(RemoteManifest(self.manifest_path), link="hard")
+        with patch("p5d.synchronizer.os.link", side_effect=OSError("not supported")):
+            strategy.sync(self.src, self.dst, self.log_path)
+        self.assertFalse((self.dst / "sub" / "b.jpg").samefile(self.src / "sub" / "b.jpg"))
+        self.assertEqual((self.dst / "sub" / "b.jpg").read_text(), "b")
+
+    def test_file_syncer_native(self):
+        self.config_loader.config["custom"]["sync_strategy"] = "native"
+        try:
+            syncer = FileSyncer(self.config_loader, self.mock_logger)
+        finally:
+            self.config_loader.config["custom"].pop("sync_strategy")
+        self.assertIsInstance(syncer.sync_strategy, NativeSyncStrategy)
+        (self.src / "sub" / "b.jpg").write_text("b")
+        jobs = syncer.make_jobs(self.src, self.dst)
+        self.assertEqual(len(jobs), 1)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,7 +1,12 @@
+import errno
+import os
+import unicodedata
 import unittest
 from pathlib import Path
 from unittest.mock import MagicMock, Mock, mock_open, patch, call
 
+from p5d import utils
+from p5d.utils import TagMatcher, move_file
 from tests.test_base import TestBase, TEST_LOCAL, TEST_REMOTE
 
 
@@ -81,6 +86,140 @@ class TestConfigLoader(TestBase):
         self.config_loader.update_config({"file_type": "new1, new2, new3"})
         self.assertEqual(self.config_loader.config["file_type"], ["new1", "new2", "new3"])
 
+    def test_routing_table(self):
+        routes = self.config_loader.get_routing_table()
+        combined_paths = self.config_loader.get_combined_paths()
+        self.assertEqual(list(routes), list(self.config_loader.get_categories()))
+        self.assertEqual(routes["Marin"].local_path, Path(combined_paths["Marin"]["local_path"]))
+        self.assertEqual(routes["BlueArchive"].resolver, "category")
+        self.assertEqual(routes["IdolMaster"].resolver, "child")
+        self.assertEqual(routes["Others"].resolver, "filename")
+        self.assertEqual(routes["Marin"].resolver, "simple")
+
+    def test_routing_table_recompiled_on_update(self):
+        routes = self.config_loader.get_routing_table()
+        self.config_loader.update_config({"local": "path/to/local"})
+        self.assertIsNot(self.config_loader.get_routing_table(), routes)
+        self.assertEqual(
+            self.config_loader.get_routing_table()["Marin"].local_path.parent, Path("path/to/local")
+        )
+
+
+class TestTagMatcher(TestBase):
+    def setUp(self):
+        super().setUp()
+        tags = {"ブルーアーカイブ": "BA", "亞絲娜": "一之瀬アスナ", "others": "其他角色"}
+        tags = {utils.normalize_tag(alias): folder for alias, folder in tags.items()}
+        self.matcher = TagMatcher(tags, self.config_loader.get_delimiters())
+
+    def test_match_normalized_alias(self):
+        file_name = unicodedata.normalize("NFD", "file1,ブルーアーカイブ,NoTag.jpg")
+        folder, tag = self.matcher.match(file_name)
+        self.assertEqual(folder, "BA")
+        self.assertEqual(unicodedata.normalize("NFC", tag), "ブルーアーカイブ")
+
+    def test_match_last_tag(self):
+        self.assertEqual(self.matcher.match("file2,NoTag,亞絲娜.jpg"), ("一之瀬アスナ", "亞絲娜"))
+
+    def test_unmatched(self):
+        self.assertEqual(self.matcher.match("file3,NoTag1,NoTag2.jpg"), ("其他角色", ""))
+        self.matcher.match("file4,NoTag1.jpg")
+        self.assertEqual(self.matcher.unmatched["NoTag1"], 2)
+        self.assertEqual(self.matcher.unmatched["NoTag2"], 1)
+        self.assertNotIn("file3", self.matcher.unmatched)
+        self.assertNotIn("file4", self.matcher.unmatched)
+
+    def test_id_field_not_matched(self):
+        self.assertEqual(self.matcher.match("亞絲娜,NoTag.jpg"), ("其他角色", ""))
+        self.assertNotIn("亞絲娜", self.matcher.unmatched)
+
+
+class TestWalkTree(TestBase):
+    def tearDown(self):
+        super().tearDownTestFile()
+
+    def test_with_stat(self):
+        folder = self.root_dir / TEST_LOCAL / "walk"
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / "a.jpg").write_text("four")
+        files = list(utils.walk_tree([folder], with_stat=True))
+        self.assertEqual([(entry.name, stat.st_size) for entry, stat in files], [("a.jpg", 4)])
+
+
+class TestSafeRmtree(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.folder = self.root_dir / TEST_LOCAL / "drained"
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+    def tearDown(self):
+        super().tearDownTestFile()
+
+    def test_remove_system_files_only(self):
+        (self.folder / ".DS_Store").write_text("")
+        self.assertTrue(utils.safe_rmtree(self.folder))
+        self.assertFalse(self.folder.exists())
+
+    def test_keep_leftovers(self):
+        (self.folder / "script.py").write_text("")
+        self.assertFalse(utils.safe_rmtree(self.folder))
+        (self.folder / "script.py").unlink()
+        (self.folder / "sub").mkdir()
+        self.assertFalse(utils.safe_rmtree(self.folder))
+        self.assertTrue(self.folder.exists())
+
+    def test_entry_limit(self):
+        (self.folder / ".DS_Store").write_text("")
+        (self.folder / "Thumbs.db").write_text("")
+        self.assertFalse(utils.safe_rmtree(self.folder, max_entries=1))
+        self.assertFalse(utils.safe_rmtree(self.root_dir / TEST_LOCAL / "missing"))
+
+
+class TestMoveFile(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.src_dir = self.root_dir / TEST_LOCAL / "src"
+        self.dst_dir = self.root_dir / TEST_LOCAL / "dst"
+        self.src_dir.mkdir(parents=True, exist_ok=True)
+        self.dst_dir.mkdir(parents=True, exist_ok=True)
+        self.src = self.src_dir / "file1.jpg"
+        self.src.write_bytes(os.urandom(3 * 1024 * 1024 + 7))
+        os.utime(self.src, (1_000_000_000, 1_000_000_000))
+
+    def tearDown(self):
+        super().tearDownTestFile()
+        utils.CROSS_DEVICE_PAIRS.clear()
+
+    def test_same_device(self):
+        data = self.src.read_bytes()
+        move_file(self.src, self.dst_dir / "file1.jpg")
+        self.assertFalse(self.src.exists())
+        self.assertEqual((self.dst_dir / "file1.jpg").read_bytes(), data)
+
+    def test_cross_device(self):
+        data = self.src.read_bytes()
+        dst = self.dst_dir / "file1.jpg"
+        with patch("p5d.utils.os.rename", side_effect=OSError(errno.EXDEV, "cross-device")):
+            move_file(self.src, dst, fsync=True)
+
+        self.assertFalse(self.src.exists())
+        self.assertEqual(dst.read_bytes(), data)
+        self.assertEqual(int(dst.stat().st_mtime), 1_000_000_000)
+        self.assertEqual(len(utils.CROSS_DEVICE_PAIRS), 1)
+
+    def test_copy_other_os(self):
+        data = self.src.read_bytes()
+        dst = self.dst_dir / "file1.jpg"
+        with (
+            patch("p5d.utils.USER_OS", "Windows"),
+            patch("p5d.utils._copy_data") as mock_copy_data,
+        ):
+            utils.copy_file(self.src, dst, fsync=True)
+
+        mock_copy_data.assert_not_called()
+        self.assertEqual(dst.read_bytes(), data)
+        self.assertEqual(int(dst.stat().st_mtime), 1_000_000_000)
+
 
 if __name__ == "__main__":
     unittest.main()
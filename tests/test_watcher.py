@@ -0,0 +1,124 @@
+import shutil
+import threading
+import time
+import unittest
+
+from p5d.utils import DirectorySnapshot
+from p5d.watcher import PollingWatcher, create_watcher, watch
+from tests.test_base import TEST_LOCAL, TestBase
+
+
+class TestWatcher(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.root = self.root_dir / TEST_LOCAL
+        (self.root / "others").mkdir(parents=True, exist_ok=True)
+
+    def tearDown(self):
+        super().tearDownTestFile()
+
+    def test_polling_detects_new_file(self):
+        watcher = PollingWatcher(self.root, interval=0.01)
+        self.assertFalse(watcher.wait(0.01))
+        time.sleep(0.01)
+        (self.root / "others" / "file1.jpg").write_text("test")
+        self.assertTrue(watcher.wait(0.01))
+        self.assertFalse(watcher.wait(0.01))
+
+    def test_create_watcher_detects_new_file(self):
+        watcher = create_watcher(self.root, self.mock_logger)
+        threading.Timer(0.05, (self.root / "file1.jpg").write_text, ["test"]).start()
+        try:
+            self.assertTrue(watcher.wait(2.0))
+        finally:
+            watcher.close()
+
+    def test_reset_ignores_own_changes(self):
+        for watcher in [
+            PollingWatcher(self.root, interval=0.01),
+            create_watcher(self.root, self.mock_logger),
+        ]:
+            try:
+                time.sleep(0.01)
+                (self.root / "others" / "sub").mkdir()
+                (self.root / "others" / "sub" / "file1.jpg").write_text("test")
+                watcher.reset()
+                self.assertFalse(watcher.wait(0.05))
+            finally:
+                watcher.close()
+                shutil.rmtree(self.root / "others" / "sub")
+
+    def test_watch_runs_batch(self):
+        batches = []
+        watch(self.root, lambda: batches.append(1), self.mock_logger, settle=0.05, max_batches=1)
+        self.assertEqual(len(batches), 1)
+
+    def test_failed_batch_keeps_watching(self):
+        batches = []
+
+        def on_batch():
+            batches.append(1)
+            if len(batches) == 1:
+                raise OSError("remote not mounted")
+            (self.root / "others" / "file1.jpg").write_text("test")
+
+        threading.Timer(0.2, (self.root / "file1.jpg").write_text, ["test"]).start()
+        watch(self.root, on_batch, self.mock_logger, settle=0.05, max_batches=2)
+        self.assertEqual(len(batches), 2)
+        self.mock_logger.error.assert_called_once()
+
+    def test_file_landed_during_batch(self):
+        seen = []
+
+        def on_batch():
+            seen.append(sorted(path.name for path in self.root.glob("*.jpg")))
+            if len(seen) == 1:
+                threading.Timer(0.1, (self.root / "file2.jpg").write_text, ["test"]).start()
+                time.sleep(0.3)
+                # Moved by the batch, not a new download
+                (self.root / "file1.jpg").rename(self.root / "others" / "file1.jpg")
+
+        (self.root / "file1.jpg").write_text("test")
+        thread = threading.Thread(
+            target=watch,
+            args=(self.root, on_batch, self.mock_logger),
+            kwargs={"settle": 0.05, "max_batches": 2},
+            daemon=True,
+        )
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(seen, [["file1.jpg"], ["file2.jpg"]])
+
+    def test_wait_for_growing_file(self):
+        file_path = self.root / "others" / "file1.jpg"
+        file_path.write_text("test")
+        sizes = []
+
+        def append():
+            for _ in range(4):
+                time.sleep(0.03)
+                with open(file_path, "a") as f:
+                    f.write("test")
+
+        writer = threading.Thread(target=append)
+        writer.start()
+        watch(
+            self.root,
+            lambda: sizes.append(file_path.stat().st_size),
+            self.mock_logger,
+            settle=0.1,
+            max_batches=1,
+        )
+        writer.join()
+        self.assertEqual(sizes, [20])
+
+    def test_skip_partial_download(self):
+        (self.root / "file1.jpg").write_text("test")
+        (self.root / "file2.jpg.crdownload").write_text("test")
+        files = [path.name for path in DirectorySnapshot().files(self.root)]
+        self.assertEqual(files, ["file1.jpg"])
+
+
+if __name__ == "__main__":
+    unittest.main()